@@ -1,56 +1,77 @@
-import os
+import argparse
+import copy
 import re
 import random
-from dotenv import load_dotenv
-from huggingface_hub import login
-import torch
-from transformers import AutoProcessor, Gemma3ForConditionalGeneration
+from generationCore import generate, stream
+from modelRegistry import enable_prefix_cache
 
 DEFAULT_TEMP = 1.2
-MODEL_ID = "google/gemma-3-4b-it"
-
-load_dotenv()
-hf_token = os.environ.get("HUGGING_FACE")
-if not hf_token:
-    raise ValueError("HUGGING_FACE environment variable is not set.")
-login(token=hf_token)
-
-processor = AutoProcessor.from_pretrained(MODEL_ID)
-model = Gemma3ForConditionalGeneration.from_pretrained(
-    MODEL_ID,
-    device_map="auto"
-).eval()
-
-current_topic_info = {
-    "initiator": None,
-    "rounds": 0
-}
-end_signalers = set()
-next_speaker_override = None
+
+def generate_texts(
+    prompts: list[str],
+    max_new_tokens: int = 100,
+    do_sample: bool = True,
+    temperature: float = DEFAULT_TEMP,
+    batch_size: int = 8,
+    seed: int | None = None,
+    stop: list | None = None
+) -> list[str]:
+    conversations = [[{"role": "user", "content": prompt}] for prompt in prompts]
+    return generate(
+        conversations,
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        temperature=temperature,
+        batch_size=batch_size,
+        seed=seed,
+        stop=stop
+    )
 
 def generate_text(
     prompt: str,
     max_new_tokens: int = 100,
     do_sample: bool = True,
-    temperature: float = DEFAULT_TEMP
+    temperature: float = DEFAULT_TEMP,
+    seed: int | None = None,
+    stop: list | None = None
 ) -> str:
-    messages = [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
-    inputs = processor.apply_chat_template(
-        messages,
-        add_generation_prompt=True,
-        tokenize=True,
-        return_dict=True,
-        return_tensors="pt"
-    ).to(model.device, dtype=torch.bfloat16)
-    input_len = inputs["input_ids"].shape[-1]
-    with torch.inference_mode():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            do_sample=do_sample,
-            temperature=temperature
-        )
-    return processor.decode(outputs[0][input_len:], skip_special_tokens=True).strip()
+    return generate_texts(
+        [prompt],
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        temperature=temperature,
+        seed=seed,
+        stop=stop
+    )[0]
+
+# stop as soon as clean_generated_text has what it keeps: a closed code fence or
+# quote, or the start of another speaker's line
+RESPONSE_STOPS = [
+    re.compile(r'```[^`]+```'),
+    re.compile(r'^[^`]*"[^"`]+"'),
+    re.compile(r'^[^`]*“[^”`]+”'),
+    re.compile(r'(?=\n\s*[A-Z][A-Za-z]+\s*:)'),
+]
+
+def stream_text(
+    prompt: str,
+    max_new_tokens: int = 100,
+    do_sample: bool = True,
+    temperature: float = DEFAULT_TEMP,
+    seed: int | None = None,
+    stop: list | None = None
+):
+    return stream(
+        [{"role": "user", "content": prompt}],
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        temperature=temperature,
+        seed=seed,
+        stop=stop
+    )
+
+def print_chunk(chunk):
+    print(chunk, end="", flush=True)
 
 def clean_generated_text(generated_text, prompt=""):
     if prompt and generated_text.startswith(prompt):
@@ -71,38 +92,12 @@ def clean_generated_text(generated_text, prompt=""):
 def build_dialog_prompt(dialog_turns):
     return "\n".join(f"{turn['speaker']}: {turn['text']}" for turn in dialog_turns)
 
-def decide_action(dialog_turns, agent):
-    global current_topic_info, end_signalers, next_speaker_override
-    if dialog_turns:
-        last = dialog_turns[-1]
-        txt = last['text'].lower()
-        if any(w in txt for w in ["schluss", "ende", "abschließen", "beenden"]):
-            end_signalers.add(last['speaker'])
-    if next_speaker_override and agent.name == next_speaker_override:
-        next_speaker_override = None
-        return "reflect_end" if end_signalers and agent.name not in end_signalers else agent.special_fallback
-    if next_speaker_override:
-        return None
-    for action, prob in agent.special_actions.items():
-        if random.random() < prob:
-            return action
-    if end_signalers and agent.name not in end_signalers:
-        return "reflect_end"
-    if dialog_turns and dialog_turns[-1]['text'].strip().endswith('?'):
-        return "confirm"
-    if current_topic_info['initiator'] is None:
-        return "change"
-    if current_topic_info['rounds'] == 0:
-        return "support" if agent.name != current_topic_info['initiator'] else random.choices(["support","confirm"],[0.7,0.3])[0]
-    if current_topic_info['rounds'] >= 2:
-        return random.choices(["change","support"],[0.6,0.4])[0]
-    return random.choices(["change","support"],[0.4,0.6])[0]
-
 class Agent:
     def __init__(
         self, name, topics, role_desc,
         special_actions=None,
-        special_fallback="support"
+        special_fallback="support",
+        on_text=None
     ):
         self.name = name
         self.topics = topics
@@ -110,6 +105,8 @@ class Agent:
         self.current_topic_index = 0
         self.special_actions = special_actions or {}
         self.special_fallback = special_fallback
+        # called with every streamed chunk; None means the turn is generated in one piece
+        self.on_text = on_text
 
     def get_current_topic(self):
         return self.topics[self.current_topic_index] if self.current_topic_index < len(self.topics) else None
@@ -117,85 +114,214 @@ class Agent:
     def mark_topic_done(self):
         self.current_topic_index += 1
 
-    def generate_response(self, prompt, max_new_tokens=100):
-        raw = generate_text(prompt, max_new_tokens=max_new_tokens)
-        return clean_generated_text(raw, prompt)
-
-    def speak_greeting(self, scene):
-        prompt = f"Scene: {scene}\n# role: {self.name}\n{self.role_desc}\n# task: Greet briefly.\nGreeting:"
-        return self.generate_response(prompt, max_new_tokens=50)
-    def speak_confirm(self, dialog_turns):
-        prompt = f"# dialog:\n{build_dialog_prompt(dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n# task: Answer clearly.\nResponse:"
-        return self.generate_response(prompt)
-    def speak_support(self, dialog_turns):
-        prompt = f"# dialog:\n{build_dialog_prompt(dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n# task: Provide a short supportive comment.\nResponse:"
-        return self.generate_response(prompt)
-    def speak_change(self, dialog_turns):
-        global current_topic_info
-        current_topic_info['initiator'] = self.name
-        current_topic_info['rounds'] = 0
+    def generate_response(self, prompt, max_new_tokens=100, stop=RESPONSE_STOPS):
+        # the raw text of one turn, streamed through on_text when set
+        if self.on_text is None:
+            return generate_text(prompt, max_new_tokens=max_new_tokens, stop=stop)
+        raw = ""
+        for chunk in stream_text(prompt, max_new_tokens=max_new_tokens, stop=stop):
+            self.on_text(chunk)
+            raw += chunk
+        return raw
+
+    # prompt_<action>(session) -> (prompt, max_new_tokens); topic changes and probes
+    # update the session they are asked for
+    def prompt_greeting(self, scene):
+        return f"Scene: {scene}\n# role: {self.name}\n{self.role_desc}\n# task: Greet briefly.\nGreeting:", 50
+    def prompt_confirm(self, session):
+        return f"# dialog:\n{build_dialog_prompt(session.dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n# task: Answer clearly.\nResponse:", 100
+    def prompt_support(self, session):
+        return f"# dialog:\n{build_dialog_prompt(session.dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n# task: Provide a short supportive comment.\nResponse:", 100
+    def prompt_change(self, session):
+        session.topic_info['initiator'] = self.name
+        session.topic_info['rounds'] = 0
         self.mark_topic_done()
         new_topic = self.get_current_topic()
-        prompt = f"# dialog:\n{build_dialog_prompt(dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n"
+        prompt = f"# dialog:\n{build_dialog_prompt(session.dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n"
         prompt += (f"# task: Introduce new topic: {new_topic}.\nResponse:" if new_topic else "# task: Provide a polite closing.\nResponse:")
-        return self.generate_response(prompt, max_new_tokens=150)
-    def speak_reflect_end(self, dialog_turns):
-        prompt = f"# dialog:\n{build_dialog_prompt(dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n# task: Reflect briefly if it's time to end; you may stay silent or offer a short thought.\nResponse:"
-        return self.generate_response(prompt, max_new_tokens=50)
-    def speak_summary(self, dialog_turns):
+        return prompt, 150
+    def prompt_reflect_end(self, session):
+        return f"# dialog:\n{build_dialog_prompt(session.dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n# task: Reflect briefly if it's time to end; you may stay silent or offer a short thought.\nResponse:", 50
+    def prompt_summary(self, session):
         prompt = (
-            f"# dialog:\n{build_dialog_prompt(dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n"
+            f"# dialog:\n{build_dialog_prompt(session.dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n"
             "# task: Provide a concise summary and ask everyone to commit: 'So you are saying, that ...?'\nResponse:"
         )
-        return self.generate_response(prompt, max_new_tokens=100)
-    def speak_probe(self, dialog_turns):
-        global next_speaker_override
-        others = [a for a in all_agents if a.name != self.name]
-        target = random.choice(others).name if others else None
-        next_speaker_override = target
+        return prompt, 100
+    def prompt_probe(self, session):
+        others = [a for a in session.agents if a.name != self.name]
+        target = session.random.choice(others).name if others else None
+        session.next_speaker_override = target
         prompt = (
-            f"# dialog:\n{build_dialog_prompt(dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n"
+            f"# dialog:\n{build_dialog_prompt(session.dialog_turns)}\n# role: {self.name}\n{self.role_desc}\n"
             f"# task: Ask a direct probing question to {target}. Response:"
         )
-        return self.generate_response(prompt, max_new_tokens=100)
-
-def run_dialog_simulation(agents, max_rounds=10):
-    global all_agents, next_speaker_override
-    all_agents = agents
-    dialog_turns = []
-    scene = generate_text(f"Generate a concise scene description for: {', '.join(a.name for a in agents)}", max_new_tokens=80)
-    dialog_turns.append({"speaker":"Narrator","text":scene})
-    print(f"Scene: {scene}\n")
-    for a in agents:
-        g = a.speak_greeting(scene)
-        dialog_turns.append({"speaker":a.name,"text":g})
-        print(f"{a.name}: {g}")
-    for rnd in range(1, max_rounds+1):
-        if not any(a.get_current_topic() for a in agents): break
-        print(f"\n--- Round {rnd} ---")
-        if next_speaker_override:
-            speaker = next(a for a in agents if a.name==next_speaker_override)
-            action = decide_action(dialog_turns, speaker)
-            next_speaker_override = None
-            line = getattr(speaker, f"speak_{action}")(dialog_turns) if action else ''
-            dialog_turns.append({"speaker":speaker.name,"text":line})
-            print(f"{speaker.name} ({action}): {line}")
-            continue
+        return prompt, 100
+
+class Turn:
+    # one generation a session waits for; label is what the transcript prints
+    def __init__(self, label, prompt, max_new_tokens, stop=None, agent=None):
+        self.label = label
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.stop = stop
+        self.agent = agent
+
+class DialogSession:
+    # The state of one dialog: its own copies of the agents (topic progress), the
+    # current topic, who signalled the end and who was asked to answer next. turns()
+    # is a generator that yields every Turn to generate and takes the raw text back
+    # through send(), so a runner can drive one session turn by turn or many at once.
+    # seed=None draws from the random module like the single dialog always did.
+    def __init__(self, agents, max_rounds=10, seed=None, verbose=False):
+        self.agents = [copy.copy(a) for a in agents]
+        self.max_rounds = max_rounds
+        self.random = random if seed is None else random.Random(seed)
+        self.verbose = verbose
+        self.topic_info = {"initiator": None, "rounds": 0}
+        self.end_signalers = set()
+        self.next_speaker_override = None
+        self.dialog_turns = []
+
+    def decide_action(self, agent):
+        dialog_turns = self.dialog_turns
+        if dialog_turns:
+            last = dialog_turns[-1]
+            txt = last['text'].lower()
+            if any(w in txt for w in ["schluss", "ende", "abschließen", "beenden"]):
+                self.end_signalers.add(last['speaker'])
+        if self.next_speaker_override and agent.name == self.next_speaker_override:
+            self.next_speaker_override = None
+            return "reflect_end" if self.end_signalers and agent.name not in self.end_signalers else agent.special_fallback
+        if self.next_speaker_override:
+            return None
+        for action, prob in agent.special_actions.items():
+            if self.random.random() < prob:
+                return action
+        if self.end_signalers and agent.name not in self.end_signalers:
+            return "reflect_end"
+        if dialog_turns and dialog_turns[-1]['text'].strip().endswith('?'):
+            return "confirm"
+        if self.topic_info['initiator'] is None:
+            return "change"
+        if self.topic_info['rounds'] == 0:
+            return "support" if agent.name != self.topic_info['initiator'] else self.random.choices(["support","confirm"],[0.7,0.3])[0]
+        if self.topic_info['rounds'] >= 2:
+            return self.random.choices(["change","support"],[0.6,0.4])[0]
+        return self.random.choices(["change","support"],[0.4,0.6])[0]
+
+    def say(self, agent, action, label=None):
+        # the turn of agent for action; yields it and appends the cleaned line
+        if not action:
+            line = ''
+            if self.verbose:
+                print(f"{label}: ")
+        else:
+            prompt, max_new_tokens = getattr(agent, f"prompt_{action}")(self)
+            raw = yield Turn(label or f"{agent.name} ({action})", prompt, max_new_tokens, RESPONSE_STOPS, agent)
+            line = clean_generated_text(raw, prompt)
+        self.dialog_turns.append({"speaker":agent.name,"text":line})
+        return line
+
+    def turns(self):
+        agents = self.agents
+        scene = yield Turn("Scene", f"Generate a concise scene description for: {', '.join(a.name for a in agents)}", 80)
+        self.dialog_turns.append({"speaker":"Narrator","text":scene})
         for a in agents:
-            action = decide_action(dialog_turns, a)
-            if not action: continue
-            method = getattr(a, f"speak_{action}")
-            line = method(dialog_turns)
-            dialog_turns.append({"speaker":a.name,"text":line})
-            print(f"{a.name} ({action}): {line}")
-            if action in ("support","confirm") and current_topic_info['initiator']:
-                current_topic_info['rounds'] += 1
-    full = "\n".join(f"{t['speaker']}: {t['text']}" for t in dialog_turns)
-    xml = "".join(f"<sp who=\"#{t['speaker']}\"><speaker>{t['speaker']}.</speaker><p>{t['text']}</p></sp>\n" for t in dialog_turns)
+            prompt, max_new_tokens = a.prompt_greeting(scene)
+            raw = yield Turn(a.name, prompt, max_new_tokens, RESPONSE_STOPS, a)
+            self.dialog_turns.append({"speaker":a.name,"text":clean_generated_text(raw, prompt)})
+        for rnd in range(1, self.max_rounds+1):
+            if not any(a.get_current_topic() for a in agents): break
+            if self.verbose:
+                print(f"\n--- Round {rnd} ---")
+            if self.next_speaker_override:
+                speaker = next(a for a in agents if a.name==self.next_speaker_override)
+                action = self.decide_action(speaker)
+                self.next_speaker_override = None
+                yield from self.say(speaker, action, f"{speaker.name} ({action})")
+                continue
+            for a in agents:
+                action = self.decide_action(a)
+                if not action: continue
+                yield from self.say(a, action)
+                if action in ("support","confirm") and self.topic_info['initiator']:
+                    self.topic_info['rounds'] += 1
+        return self.transcript()
+
+    def transcript(self):
+        full = "\n".join(f"{t['speaker']}: {t['text']}" for t in self.dialog_turns)
+        xml = "".join(f"<sp who=\"#{t['speaker']}\"><speaker>{t['speaker']}.</speaker><p>{t['text']}</p></sp>\n" for t in self.dialog_turns)
+        return full, xml
+
+def run_dialog_simulation(agents, max_rounds=10, streaming=False, seed=None):
+    session = DialogSession(agents, max_rounds, seed=seed, verbose=True)
+    # streaming prints the turns of agents without a callback of their own; the
+    # session works on copies, so the callers' agents stay as they are
+    if streaming:
+        for a in session.agents:
+            if a.on_text is None:
+                a.on_text = print_chunk
+    turns = session.turns()
+    raw = None
+    try:
+        while True:
+            turn = turns.send(raw)
+            if turn.agent is None:
+                raw = generate_text(turn.prompt, max_new_tokens=turn.max_new_tokens)
+                print(f"Scene: {raw}\n")
+                continue
+            # streamed turns print the raw text while it arrives, the others the cleaned line
+            if streaming:
+                print(f"{turn.label}: ", end="", flush=True)
+            raw = turn.agent.generate_response(turn.prompt, max_new_tokens=turn.max_new_tokens, stop=turn.stop)
+            if streaming:
+                print()
+            else:
+                print(f"{turn.label}: {clean_generated_text(raw, turn.prompt)}")
+    except StopIteration as done:
+        full, xml = done.value
     print("\nFinal Dialogue:\n", full)
     return full, xml
 
+def run_dialog_sessions(sessions, batch_size=32):
+    # Advances all sessions together: every tick collects the turn each unfinished
+    # session waits for and generates them in one batched call per (max_new_tokens,
+    # stop) group, so the number of model calls grows with the dialog length, not
+    # with the number of sessions. Returns (full, xml) per session.
+    results = [None] * len(sessions)
+    waiting = {}
+    for i, session in enumerate(sessions):
+        turns = session.turns()
+        waiting[i] = (turns, next(turns))
+    while waiting:
+        groups = {}
+        for i, (_, turn) in waiting.items():
+            groups.setdefault((turn.max_new_tokens, turn.stop is not None), []).append(i)
+        answers = {}
+        for (max_new_tokens, stopped), indices in groups.items():
+            outputs = generate_texts(
+                [waiting[i][1].prompt for i in indices],
+                max_new_tokens=max_new_tokens,
+                batch_size=batch_size,
+                stop=RESPONSE_STOPS if stopped else None
+            )
+            answers.update(zip(indices, outputs))
+        for i, raw in answers.items():
+            turns = waiting[i][0]
+            try:
+                waiting[i] = (turns, turns.send(raw))
+            except StopIteration as done:
+                results[i] = done.value
+                del waiting[i]
+    return results
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a dialog between three agents")
+    parser.add_argument("--sessions", type=int, default=1, help="independent dialogs generated together in batches")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
     def save_dialog_history(prompt, xml, prefix="dialog"):
         with open(f"{prefix}_prompt.txt", "w") as f:
             f.write(prompt)
@@ -222,6 +348,13 @@ if __name__ == "__main__":
     )
 
     agents = [agent1, agent2, agent3]
-    final_prompt, final_xml = run_dialog_simulation(agents, max_rounds=10)
-    save_dialog_history(final_prompt, final_xml)
-    print("\n--- Dialog history saved to files. ---")
+    enable_prefix_cache()
+    if args.sessions > 1:
+        sessions = [DialogSession(agents, max_rounds=10, seed=i) for i in range(args.sessions)]
+        for i, (final_prompt, final_xml) in enumerate(run_dialog_sessions(sessions, batch_size=args.batch_size)):
+            save_dialog_history(final_prompt, final_xml, prefix=f"dialog_{i}")
+        print(f"\n--- {args.sessions} dialog histories saved to files. ---")
+    else:
+        final_prompt, final_xml = run_dialog_simulation(agents, max_rounds=10, streaming=True)
+        save_dialog_history(final_prompt, final_xml)
+        print("\n--- Dialog history saved to files. ---")
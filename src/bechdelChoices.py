@@ -1,30 +1,104 @@
 import os
-import glob
 import csv
 import re
-from generateText import generate_text
+from cascade import Cascade
+from chunking import REDUCE_RULES, chunk_text, mean_distribution, reduce_values
+from corpusStore import Corpus
+from generateText import (
+    enable_prefix_cache, enable_response_cache, generate_texts,
+    score_options_batch
+)
+from generationCore import count_tokens
+from modelRegistry import MODEL_ID
+from promptTemplate import FilledPrompt, PromptTemplate, literal
+from resultStore import ResultStore, model_key
+from selfConsistency import vote
+from structuredOutput import JSON_OBJECT_STOP, extract_json_object, match_option
 from typing import List
 
 class StatementSet:
-    def __init__(self, name: str, prompt_intro: str, statements: List[str]):
+    # score of the first, second and third statement
+    values = [1.0, 0.0, -1.0]
+    # relative cost of one rating: a single forward pass, a short answer, several samples
+    costs = {"score": 1, "generate": 2, "vote": 4}
+    # the answer letter is all parse_response reads
+    stop = [re.compile(r'^\s*[a-c](?:[).:]|\s*\n)', re.IGNORECASE)]
+
+    def __init__(self, name: str, prompt_intro: str, statements: List[str], mode: str = "generate",
+                 max_prompt_tokens: int | None = None, reduce: str = "majority", chunk_overlap: int = 1,
+                 requires: dict[str, str] | None = None, cascade: Cascade | None = None):
+        if mode not in ("generate", "score", "vote"):
+            raise ValueError(f"Unknown mode: {mode}")
+        if cascade is not None and mode == "generate":
+            raise ValueError("A cascade needs a confidence, use mode score or vote")
+        if reduce not in REDUCE_RULES:
+            raise ValueError(f"Unknown reduce rule: {reduce}")
         self.name = name
         self.prompt_intro = prompt_intro
         self.statements = statements
-
-    def process(self, conversation: str) -> float:
+        self.mode = mode
+        # longer conversations are rated in chunks, combined with the reduce rule
+        # over the statement values (1.0 for the first statement)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.reduce = reduce
+        self.chunk_overlap = chunk_overlap
+        # set name -> answer letters that set must give for this one to be asked,
+        # e.g. {'Women': 'a'}: only when both women are talking
+        self.requires = requires or {}
+        self.cascade = cascade
+        # whole conversation and chunk prompt; the static text is tokenised once
         options = "\n".join(
             f"{chr(97 + i)}) {text}" for i, text in enumerate(self.statements)
         )
-        prompt = (
-            f"{self.prompt_intro}\n"
-            f"Conversation:\n{conversation}\n"
-            f"{options}\n"
-            "Answer with a, b, or c."
+        question = literal(f"{self.prompt_intro}\n{options}\nAnswer with a, b, or c.")
+        self.templates = (
+            PromptTemplate("Conversation:\n{conversation}\n" + question),
+            PromptTemplate("Conversation excerpt (part {part} of {parts}):\n{conversation}\n" + question)
         )
-        response = generate_text(prompt).strip().lower()
+
+    @property
+    def criterion(self) -> str:
+        return "\n".join([self.prompt_intro, *self.statements])
+
+    @property
+    def letters(self) -> List[str]:
+        return [chr(97 + i) for i in range(len(self.statements))]
+
+    def fill_prompt(self, conversation: str, part: tuple[int, int] | None = None) -> FilledPrompt:
+        if part is None:
+            return self.templates[0].fill(conversation=conversation)
+        return self.templates[1].fill(conversation=conversation, part=part[0], parts=part[1])
+
+    def build_prompt(self, conversation: str, part: tuple[int, int] | None = None) -> str:
+        return self.fill_prompt(conversation, part).text
+
+    def prompts(self, conversation: str) -> List[FilledPrompt]:
+        if self.max_prompt_tokens is None:
+            return [self.fill_prompt(conversation)]
+        budget = max(64, self.max_prompt_tokens - count_tokens(self.build_prompt("", (1, 1))))
+        chunks = chunk_text(conversation, budget, self.chunk_overlap)
+        if len(chunks) == 1:
+            return [self.fill_prompt(conversation)]
+        return [self.fill_prompt(chunk, (k + 1, len(chunks))) for k, chunk in enumerate(chunks)]
+
+    def reduce_results(self, results: List[dict]) -> dict:
+        if len(results) == 1:
+            return results[0]
+        # expected scores are continuous, a majority over them is their mean
+        rule = "mean" if self.reduce == "majority" and self.mode != "generate" else self.reduce
+        reduced = {'score': reduce_values(rule, [result['score'] for result in results])}
+        if 'distribution' in results[0]:
+            reduced['distribution'] = mean_distribution([result['distribution'] for result in results])
+        if 'samples' in results[0]:
+            reduced['samples'] = sum(result['samples'] for result in results)
+        print(f"{self.name}: {reduced['score']} from {len(results)} chunks ({self.reduce})\n")
+        return reduced
+
+    def parse_response(self, response: str) -> float:
+        response = response.strip().lower()
         print(f"Response:\n{response}\n")
         choice = response[:1]
-        idx = ord(choice) - 97
+        idx = ord(choice) - 97 if choice else -1
         if idx == 0:
             return 1.0
         elif idx == 1:
@@ -34,47 +108,304 @@ class StatementSet:
         else:
             return 0.0
 
+    def choice(self, response: str) -> str | None:
+        letter = response.strip().lower()[:1]
+        return letter if letter in self.letters else None
+
+    def letter_of(self, score: float) -> str:
+        # the statement nearest to a (possibly expected) score
+        values = self.values[:len(self.statements)]
+        return self.letters[min(range(len(values)), key=lambda i: abs(values[i] - score))]
+
+    def expected_score(self, distribution: dict[str, float]) -> float:
+        return sum(p * self.values[i] for i, p in enumerate(distribution.values()) if i < len(self.values))
+
+    def vote(self, prompts: List[FilledPrompt], **kwargs) -> List[dict]:
+        results = vote(prompts, self.choice, stop=self.stop, max_new_tokens=20, **kwargs)
+        for result in results:
+            # expected_score reads the shares in letter order
+            result['distribution'] = {letter: result['distribution'].get(letter, 0.0) for letter in self.letters}
+        return results
+
+    def rate_prompts(self, prompts: List[FilledPrompt], model_id: str = MODEL_ID, batch_size: int = 8,
+                     seed: int | None = None) -> List[dict]:
+        # score and vote mode: the distribution over the letters and its expected score
+        if self.mode == "score":
+            results = [
+                {'distribution': distribution}
+                for distribution in score_options_batch(prompts, self.letters, batch_size=batch_size, model_id=model_id)
+            ]
+        else:
+            results = self.vote(prompts, batch_size=batch_size, seed=seed, model_id=model_id)
+        return [{**result, 'score': self.expected_score(result['distribution'])} for result in results]
+
+    def rate(self, prompts: List[FilledPrompt], names: List[str] | None = None, batch_size: int = 8,
+             seed: int | None = None) -> List[dict]:
+        # names[i] is the set prompt i belongs to, for the cascade report
+        if self.cascade is None:
+            return self.rate_prompts(prompts, batch_size=batch_size, seed=seed)
+        return self.cascade.run(
+            names or [self.name] * len(prompts),
+            lambda indices, model_id: self.rate_prompts([prompts[i] for i in indices], model_id, batch_size, seed),
+            lambda result: max(result['distribution'], key=result['distribution'].get, default=None)
+        )
+
+    def process(self, conversation: str) -> float:
+        prompts = self.prompts(conversation)
+        if self.mode != "generate":
+            results = self.rate(prompts)
+            for result in results:
+                print(f"Choice: {self.letter_of(result['score'])} {result['distribution']}\n")
+        else:
+            results = [{'score': self.parse_response(text)} for text in generate_texts(prompts, stop=self.stop)]
+        return self.reduce_results(results)['score']
+
 class SimpleBechdelPipeline:
     def __init__(self,
                  data_folder: str,
                  output_file: str,
-                 statement_sets: List[StatementSet]):
+                 statement_sets: List[StatementSet],
+                 batch_size: int = 8,
+                 seed: int | None = None,
+                 fused: bool = False,
+                 store: ResultStore | None = None):
         self.data_folder = data_folder
-        self.input_pattern = os.path.join(data_folder, '*.txt')
         self.output_file = output_file
         self.statement_sets = statement_sets
+        self.batch_size = batch_size
+        self.seed = seed
+        # ask all generate-mode sets in one prompt per file
+        self.fused = fused
+        self.store = store
+        # fused prompt template per combination of statement sets
+        self._fused_templates: dict[tuple, PromptTemplate] = {}
+
+    @staticmethod
+    def parse_filename(filepath: str) -> tuple[str, str, str]:
+        base = os.path.splitext(os.path.basename(filepath))[0]
+        if '_' in base:
+            name_part, style = base.split('_', 1)
+        else:
+            name_part, style = base, ''
+        m = re.match(r"([a-zA-Z]+)(\d+)$", name_part)
+        if m:
+            script, number = m.group(1), m.group(2)
+        else:
+            script, number = name_part, ''
+        return script, number, style
+
+    def rate(self, jobs: list, prompts: List[FilledPrompt]) -> List[dict]:
+        rated = [{'score': 0.0} for _ in jobs]
+        generated = [i for i, (_, stmt_set) in enumerate(jobs) if stmt_set.mode == "generate"]
+        responses = generate_texts(
+            [prompts[i] for i in generated],
+            batch_size=self.batch_size,
+            seed=self.seed,
+            stop=StatementSet.stop
+        )
+        for i, response in zip(generated, responses):
+            rated[i]['score'] = jobs[i][1].parse_response(response)
+        # scored and voted sets are grouped by their options (and cascade) so each
+        # group is batched together
+        grouped: dict[tuple, list[int]] = {}
+        for i, (_, stmt_set) in enumerate(jobs):
+            if stmt_set.mode != "generate":
+                grouped.setdefault((stmt_set.mode, tuple(stmt_set.letters), stmt_set.cascade), []).append(i)
+        for indices in grouped.values():
+            results = jobs[indices[0]][1].rate(
+                [prompts[i] for i in indices],
+                [jobs[i][1].name for i in indices],
+                batch_size=self.batch_size,
+                seed=self.seed
+            )
+            for i, result in zip(indices, results):
+                print(f"Distribution for {jobs[i][1].name}: {result['distribution']}\n")
+                rated[i] = result
+        return rated
+
+    def schedule(self) -> List[List[StatementSet]]:
+        # Stages in dependency order: a set runs once all sets it requires are rated.
+        # Within a stage the sets others depend on and the cheap ones come first.
+        names = {s.name for s in self.statement_sets}
+        for stmt_set in self.statement_sets:
+            unknown = set(stmt_set.requires) - names
+            if unknown:
+                raise ValueError(f"{stmt_set.name} requires unknown statement sets: {', '.join(sorted(unknown))}")
+        dependents = {name: sum(name in s.requires for s in self.statement_sets) for name in names}
+        stages, done = [], set()
+        remaining = list(self.statement_sets)
+        while remaining:
+            ready = [s for s in remaining if set(s.requires) <= done]
+            if not ready:
+                raise ValueError(f"Cyclic requirements between {', '.join(s.name for s in remaining)}")
+            ready.sort(key=lambda s: (-dependents[s.name], StatementSet.costs[s.mode]))
+            stages.append(ready)
+            done.update(s.name for s in ready)
+            remaining = [s for s in remaining if s not in ready]
+        return stages
+
+    def blocked(self, filepath: str, stmt_set: StatementSet, scores: List[float | None], index: dict,
+                skipped: dict[int, str]) -> str | None:
+        # why stmt_set is moot for this file, None if it has to be rated
+        by_name = {s.name: s for s in self.statement_sets}
+        for name, letters in stmt_set.requires.items():
+            i = index[filepath, name]
+            if i in skipped:
+                return f"{name} skipped"
+            letter = by_name[name].letter_of(scores[i])
+            if letter not in letters:
+                return f"{name}={letter}"
+        return None
+
+    def fused_prompt(self, conversation: str, statement_sets: List[StatementSet]) -> FilledPrompt:
+        key = tuple(stmt_set.name for stmt_set in statement_sets)
+        if key not in self._fused_templates:
+            questions = "\n\n".join(
+                f"{stmt_set.name}: {stmt_set.prompt_intro}\n" +
+                "\n".join(f"{letter}) {text}" for letter, text in zip(stmt_set.letters, stmt_set.statements))
+                for stmt_set in statement_sets
+            )
+            self._fused_templates[key] = PromptTemplate(
+                "Conversation:\n{conversation}\n" +
+                literal(
+                    f"{questions}\n"
+                    "Answer with a single JSON object that maps every question name to the letter "
+                    "of its answer (a, b, or c) and nothing else."
+                )
+            )
+        return self._fused_templates[key].fill(conversation=conversation)
+
+    def rate_fused(self, files: List[str], conversations: dict[str, str],
+                   statement_sets: List[StatementSet] | None = None) -> dict[str, dict[str, float]]:
+        fused_sets = [s for s in statement_sets or self.statement_sets if s.mode == "generate"]
+        budgets = [s.max_prompt_tokens for s in fused_sets if s.max_prompt_tokens is not None]
+        prompts = {filepath: self.fused_prompt(conversations[filepath], fused_sets) for filepath in files}
+        # conversations too long for one prompt go the chunked way, set by set
+        files = [f for f in files if not budgets or count_tokens(prompts[f].text) <= min(budgets)]
+        if not fused_sets or not files:
+            return {filepath: {} for filepath in files}
+        responses = generate_texts(
+            [prompts[filepath] for filepath in files],
+            max_new_tokens=200,
+            batch_size=self.batch_size,
+            seed=self.seed,
+            stop=[JSON_OBJECT_STOP]
+        )
+        answers = {}
+        for filepath, response in zip(files, responses):
+            answer = extract_json_object(response) or {}
+            answers[filepath] = {}
+            for stmt_set in fused_sets:
+                letter = match_option(answer.get(stmt_set.name), stmt_set.letters)
+                if letter is not None:
+                    answers[filepath][stmt_set.name] = stmt_set.parse_response(letter)
+        return answers
+
+    def params(self, stmt_set: StatementSet) -> dict:
+        params = {'mode': stmt_set.mode, 'seed': self.seed, 'fused': self.fused and stmt_set.mode == "generate"}
+        if stmt_set.max_prompt_tokens is not None:
+            params.update(max_prompt_tokens=stmt_set.max_prompt_tokens, reduce=stmt_set.reduce,
+                          chunk_overlap=stmt_set.chunk_overlap)
+        if stmt_set.cascade is not None:
+            params.update(cascade=stmt_set.cascade.params)
+        return params
+
+    def rate_chunked(self, jobs: list, conversations: dict[str, str]) -> List[dict]:
+        # map: the chunks of all jobs share the batches of rate(); reduce: one result per job
+        parts = [stmt_set.prompts(conversations[filepath]) for filepath, stmt_set in jobs]
+        rated = self.rate([job for job, prompts in zip(jobs, parts) for _ in prompts],
+                          [prompt for prompts in parts for prompt in prompts])
+        results = []
+        pos = 0
+        for (_, stmt_set), prompts in zip(jobs, parts):
+            results.append(stmt_set.reduce_results(rated[pos:pos + len(prompts)]))
+            pos += len(prompts)
+        return results
+
+    def save(self, filepath: str, stmt_set: StatementSet, conversation: str, score: float,
+             distribution: dict | None = None, samples: int | None = None):
+        if self.store is not None:
+            self.store.put(stmt_set.name, stmt_set.criterion, conversation, model_key(),
+                           self.params(stmt_set), filepath, None, score, distribution, samples)
 
     def run(self):
-        files = sorted(glob.glob(self.input_pattern))
+        corpus = Corpus(self.data_folder, '*.txt')
+        files = corpus.paths()
+        conversations = {filepath: corpus.text(filepath) for filepath in files}
+        jobs = [(filepath, stmt_set) for filepath in files for stmt_set in self.statement_sets]
+        index = {(filepath, stmt_set.name): i for i, (filepath, stmt_set) in enumerate(jobs)}
+
+        scores: List[float | None] = [None] * len(jobs)
+        # job index -> reason, for sets made moot by the answer of a set they require
+        skipped: dict[int, str] = {}
+        # with a store every finished batch is saved right away
+        chunk = self.batch_size if self.store is not None else max(len(jobs), 1)
+
+        for stage in self.schedule():
+            stage_jobs = []
+            for filepath in files:
+                for stmt_set in stage:
+                    i = index[filepath, stmt_set.name]
+                    reason = self.blocked(filepath, stmt_set, scores, index, skipped)
+                    if reason is None:
+                        stage_jobs.append(i)
+                    else:
+                        skipped[i] = reason
+            print(f"Stage {', '.join(s.name for s in stage)}: {len(stage_jobs)} ratings, "
+                  f"{len(files) * len(stage) - len(stage_jobs)} skipped\n")
+
+            if self.store is not None:
+                for i in stage_jobs:
+                    filepath, stmt_set = jobs[i]
+                    row = self.store.get(stmt_set.name, stmt_set.criterion, conversations[filepath],
+                                         model_key(), self.params(stmt_set))
+                    if row is not None:
+                        scores[i] = row['score']
+                print(f"{sum(scores[i] is not None for i in stage_jobs)} of {len(stage_jobs)} "
+                      "ratings taken from the store\n")
+
+            if self.fused:
+                todo = sorted({jobs[i][0] for i in stage_jobs if scores[i] is None}, key=files.index)
+                for start in range(0, len(todo), chunk):
+                    answers = self.rate_fused(todo[start:start + chunk], conversations, stage)
+                    for filepath, answer in answers.items():
+                        for stmt_set in stage:
+                            i = index[filepath, stmt_set.name]
+                            if i not in skipped and scores[i] is None and stmt_set.name in answer:
+                                scores[i] = answer[stmt_set.name]
+                                self.save(filepath, stmt_set, conversations[filepath], scores[i])
+            # everything the store or the fused answer did not cover is rated set by set
+            pending = [i for i in stage_jobs if scores[i] is None]
+            if self.fused and pending:
+                print(f"Fallback to single-set prompts for {len(pending)} ratings\n")
+            for start in range(0, len(pending), chunk):
+                indices = pending[start:start + chunk]
+                rated = self.rate_chunked([jobs[i] for i in indices], conversations)
+                for i, result in zip(indices, rated):
+                    filepath, stmt_set = jobs[i]
+                    scores[i] = result['score']
+                    self.save(filepath, stmt_set, conversations[filepath], result['score'],
+                              result.get('distribution'), result.get('samples'))
+
         with open(self.output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['Script', 'Number', 'Style', 'Test', 'Score']
+            fieldnames = ['Script', 'Number', 'Style', 'Test', 'Score', 'Skipped']
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
 
-            for filepath in files:
-                base = os.path.splitext(os.path.basename(filepath))[0]
-                if '_' in base:
-                    name_part, style = base.split('_', 1)
-                else:
-                    name_part, style = base, ''
-                m = re.match(r"([a-zA-Z]+)(\d+)$", name_part)
-                if m:
-                    script, number = m.group(1), m.group(2)
-                else:
-                    script, number = name_part, ''
-
-                with open(filepath, encoding='utf-8') as f:
-                    conv = f.read().strip()
-
-                for stmt_set in self.statement_sets:
-                    score = stmt_set.process(conv)
-                    writer.writerow({
-                        'Script': script,
-                        'Number': number,
-                        'Style': style,
-                        'Test': stmt_set.name,
-                        'Score': score
-                    })
+            for i, ((filepath, stmt_set), score) in enumerate(zip(jobs, scores)):
+                script, number, style = self.parse_filename(filepath)
+                writer.writerow({
+                    'Script': script,
+                    'Number': number,
+                    'Style': style,
+                    'Test': stmt_set.name,
+                    'Score': '' if i in skipped else score,
+                    'Skipped': skipped.get(i, '')
+                })
+        if skipped:
+            print(f"{len(skipped)} of {len(jobs)} ratings skipped by requirements")
+        for cascade in dict.fromkeys(s.cascade for s in self.statement_sets if s.cascade is not None):
+            cascade.print_report()
         print(f"Done! Ratings saved to {self.output_file}")
 
 if __name__ == '__main__':
@@ -85,7 +416,10 @@ if __name__ == '__main__':
             'The primary subject of the conversation is something else than a man.',
             'The primary subject of the conversation is a man and in equal measure something else.',
             'The primary subject of the conversation is a specific man or men.'
-        ]
+        ],
+        max_prompt_tokens=4096,
+        reduce='majority',
+        requires={'Women': 'a'}
     )
     women_set = StatementSet(
         name='Women',
@@ -94,7 +428,9 @@ if __name__ == '__main__':
             'Both women are talking (Both have at least one line).',
             'Only one woman is talking (Only one has at least one line).',
             'No woman is talking (Neither has a line).'
-        ]
+        ],
+        max_prompt_tokens=4096,
+        reduce='any'
     )
     topic_set = StatementSet(
         name='Topic',
@@ -103,7 +439,10 @@ if __name__ == '__main__':
             'The conversation between the two women does not deal with a man.',
             'The conversation between the two women includes at least one topic other than a man.',
             'The conversation between the two women includes no other topic than a man.'
-        ]
+        ],
+        max_prompt_tokens=4096,
+        reduce='mean',
+        requires={'Women': 'a'}
     )
     conceal_set = StatementSet(
         name='Concealment',
@@ -112,12 +451,22 @@ if __name__ == '__main__':
             'The conversation is only talking in a concealed way about a man.',
             'The conversation sometimes directly refers to a man and sometimes is concealed.',
             'The conversation is openly and unconcealed about a man.'
-        ]
+        ],
+        max_prompt_tokens=4096,
+        reduce='mean',
+        requires={'Women': 'a'}
     )
 
+    enable_prefix_cache()
+    enable_response_cache()
+
+    # Subject, Topic and Concealment only matter when both women are talking
     pipeline = SimpleBechdelPipeline(
         data_folder='data/conversations',
         output_file='ratings_scored.csv',
-        statement_sets=[subject_set, women_set, topic_set, conceal_set]
+        statement_sets=[subject_set, women_set, topic_set, conceal_set],
+        seed=0,
+        fused=True,
+        store=ResultStore('ratings.db')
     )
     pipeline.run()
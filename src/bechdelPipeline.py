@@ -1,56 +1,447 @@
 #!/usr/bin/env python3
 
-import glob
+import argparse
 import csv
+import os
 import re
 
 from pipeline9 import Pipeline, PipelineStep
-from generateText import generate_text
+from cascade import Cascade
+from chunking import REDUCE_RULES, chunk_text, mean_distribution, reduce_values
+from corpusStore import Corpus
+from generateText import enable_prefix_cache, enable_response_cache, generate_texts, score_options_batch
+from generationCore import count_tokens
+from modelRegistry import MODEL_ID
+from promptTemplate import FilledPrompt, PromptTemplate, literal
+from resultStore import ResultStore, model_key
+from selfConsistency import vote
+from structuredOutput import JSON_OBJECT_STOP, extract_json_object, match_option
+
+
+def read_conversations(filenames: list[str]) -> list[str]:
+    conversations = []
+    for fname in filenames:
+        with open(fname, encoding='utf-8') as f:
+            conversations.append(f.read().strip())
+    return conversations
+
+
+def conversations_of(context: dict) -> list[str]:
+    # read once per context, every later step reuses the texts
+    if 'conversations' not in context:
+        corpus = context.get('corpus')
+        if corpus is None:
+            context['conversations'] = read_conversations(context['filenames'])
+        else:
+            context['conversations'] = [corpus.text(fname) for fname in context['filenames']]
+    return context['conversations']
+
+
+def stored_row(store: ResultStore | None, task: str, criterion: str, fname: str,
+               conversation: str, params: dict) -> dict | None:
+    if store is None:
+        return None
+    row = store.get(task, criterion, conversation, model_key(), params)
+    if row is not None:
+        row['filename'] = fname
+    return row
+
+
+def store_row(store: ResultStore | None, row: dict, conversation: str, params: dict):
+    if store is not None:
+        store.put(row['task'], row['criterion'], conversation, model_key(), params,
+                  row['filename'], row['rating'], row.get('score'), row.get('distribution'), row.get('samples'))
 
 
 class LoadConversationsStep(PipelineStep):
-    def __init__(self, pattern: str):
-        self.pattern = pattern
+    # source is a glob like "data/conversations/*.txt", a directory/archive or a Corpus
+    def __init__(self, source: str | Corpus, chunk_size: int = 8, unique: bool = True):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.unique = unique
+
+    def load(self) -> Corpus:
+        if isinstance(self.source, Corpus):
+            return self.source
+        if os.path.isdir(self.source) or os.path.isfile(self.source):
+            return Corpus(self.source)
+        return Corpus.from_pattern(self.source)
+
+    def filenames(self, corpus: Corpus) -> list[str]:
+        # duplicates are counted by the corpus
+        return corpus.paths(unique=self.unique)
 
     def process(self, context: dict) -> dict:
-        context['filenames'] = glob.glob(self.pattern)
+        corpus = self.load()
+        context['corpus'] = corpus
+        context['filenames'] = self.filenames(corpus)
         return context
 
+    def process_stream(self, items):
+        # one small context per chunk of files, so later steps still batch
+        for context in items:
+            corpus = self.load()
+            filenames = self.filenames(corpus)
+            for start in range(0, len(filenames), self.chunk_size):
+                yield {**context, 'corpus': corpus, 'filenames': filenames[start:start + self.chunk_size]}
+
 
 class ClassifyStep(PipelineStep):
-    def __init__(self, task_name: str, criterion: str, labels: list[str]):
+    vote_tokens = 20
+
+    def __init__(self, task_name: str, criterion: str, labels: list[str],
+                 batch_size: int = 8, seed: int | None = None, mode: str = "generate",
+                 store: ResultStore | None = None, samples_per_round: int = 4, max_samples: int = 16,
+                 max_prompt_tokens: int | None = None, reduce: str = "majority", chunk_overlap: int = 1,
+                 cascade: Cascade | None = None):
+        if mode not in ("generate", "score", "vote"):
+            raise ValueError(f"Unknown mode: {mode}")
+        if cascade is not None and mode == "generate":
+            raise ValueError("A cascade needs a confidence, use mode score or vote")
+        if reduce not in REDUCE_RULES:
+            raise ValueError(f"Unknown reduce rule: {reduce}")
         self.task_name = task_name
         self.criterion = criterion
         self.labels = labels
+        self.batch_size = batch_size
+        self.seed = seed
+        self.mode = mode
+        self.store = store
+        # vote mode: sampled answers per round and in total
+        self.samples_per_round = samples_per_round
+        self.max_samples = max_samples
+        # a vote sample is just the label: it ends as soon as one is named
+        self.stop = [re.compile("|".join(re.escape(lab) for lab in sorted(labels, key=len, reverse=True)), re.IGNORECASE)]
+        # conversations longer than max_prompt_tokens are rated in chunks whose
+        # ratings are combined with the reduce rule (see chunking.reduce_values)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.reduce = reduce
+        self.chunk_overlap = chunk_overlap
+        self.cascade = cascade
+        # whole conversation and chunk prompt; the static text is tokenised once
+        self.templates = (self.template("Conversation:", "the conversation above"),
+                          self.template("Conversation excerpt (part {part} of {parts}):", "the excerpt above"))
 
-    def process(self, context: dict) -> dict:
-        results = context.setdefault('results', [])
-        for fname in context['filenames']:
-            with open(fname, encoding='utf-8') as f:
-                conversation = f.read().strip()
-
-            prompt = (
-                f"Rate the following conversation against this statement: {self.criterion}\n"
-                f"Conversation:\n{conversation}\n"
-                f"First give a short explanation of your rating, then choose exactly one of the following options:" +
+    @property
+    def params(self) -> dict:
+        params = {'labels': self.labels, 'mode': self.mode, 'seed': self.seed}
+        if self.mode == "vote":
+            params.update(samples_per_round=self.samples_per_round, max_samples=self.max_samples,
+                          max_new_tokens=self.vote_tokens)
+        if self.max_prompt_tokens is not None:
+            params.update(max_prompt_tokens=self.max_prompt_tokens, reduce=self.reduce, chunk_overlap=self.chunk_overlap)
+        if self.cascade is not None:
+            params.update(cascade=self.cascade.params)
+        return params
+
+    def template(self, header: str, subject: str) -> PromptTemplate:
+        if self.mode in ("score", "vote"):
+            instruction = "Answer with exactly one of the following options and nothing else:"
+        else:
+            instruction = "First give a short explanation of your rating, then choose exactly one of the following options:"
+        return PromptTemplate(
+            f"{header}\n{{conversation}}\n" +
+            literal(
+                f"Rate {subject} against this statement: {self.criterion}\n"
+                f"{instruction}" +
                 "".join(f"\n- {lab}" for lab in self.labels)
             )
+        )
 
-            response = generate_text(prompt).strip()
-            print(f"Response for {fname}:\n{response}\n")
-            rating = next(
-                (lab for lab in self.labels if lab.lower() in response.lower()),
-                None
+    def fill_prompt(self, conversation: str, part: tuple[int, int] | None = None) -> FilledPrompt:
+        if part is None:
+            return self.templates[0].fill(conversation=conversation)
+        return self.templates[1].fill(conversation=conversation, part=part[0], parts=part[1])
+
+    def build_prompt(self, conversation: str, part: tuple[int, int] | None = None) -> str:
+        return self.fill_prompt(conversation, part).text
+
+    def prompts(self, conversation: str) -> list[FilledPrompt]:
+        if self.max_prompt_tokens is None:
+            return [self.fill_prompt(conversation)]
+        budget = max(64, self.max_prompt_tokens - count_tokens(self.build_prompt("", (1, 1))))
+        chunks = chunk_text(conversation, budget, self.chunk_overlap)
+        if len(chunks) == 1:
+            return [self.fill_prompt(conversation)]
+        return [self.fill_prompt(chunk, (k + 1, len(chunks))) for k, chunk in enumerate(chunks)]
+
+    def label_value(self, label: str) -> float:
+        # labels run from full agreement (1.0) to full disagreement (-1.0)
+        if len(self.labels) < 2:
+            return 1.0
+        return 1.0 - 2.0 * self.labels.index(label) / (len(self.labels) - 1)
+
+    def match_label(self, response: str) -> str | None:
+        return next((lab for lab in self.labels if lab.lower() in response.lower()), None)
+
+    def parse_response(self, response: str) -> str:
+        rating = self.match_label(response)
+        if rating is None:
+            rating = "Neutral"
+        return rating
+
+    def reduce_rows(self, fname: str, rows: list[dict]) -> dict:
+        if len(rows) == 1:
+            return {**rows[0], 'filename': fname}
+        value = reduce_values(self.reduce, [self.label_value(row['rating']) for row in rows])
+        row = {
+            'task': self.task_name,
+            'criterion': self.criterion,
+            'filename': fname,
+            'rating': min(self.labels, key=lambda lab: abs(self.label_value(lab) - value))
+        }
+        print(f"{self.task_name} for {fname}: {row['rating']} from {len(rows)} chunks ({self.reduce})\n")
+        if 'score' in rows[0]:
+            # scores are continuous, a majority over them is their mean
+            row['score'] = reduce_values("mean" if self.reduce == "majority" else self.reduce,
+                                         [r['score'] for r in rows])
+        if 'distribution' in rows[0]:
+            row['distribution'] = mean_distribution([r['distribution'] for r in rows])
+        if 'samples' in rows[0]:
+            row['samples'] = sum(r['samples'] for r in rows)
+        return row
+
+    def rate(self, filenames: list[str], conversations: list[str]) -> list[dict]:
+        # map: every chunk of every conversation is one prompt of the same batch
+        parts = [self.prompts(conv) for conv in conversations]
+        names = [
+            fname if len(prompts) == 1 else f"{fname} (part {k + 1}/{len(prompts)})"
+            for fname, prompts in zip(filenames, parts) for k in range(len(prompts))
+        ]
+        flat = [prompt for prompts in parts for prompt in prompts]
+        if self.cascade is None:
+            rated = self.rate_prompts(names, flat)
+        else:
+            rated = self.cascade.run(
+                [self.task_name] * len(flat),
+                lambda indices, model_id: self.rate_prompts(
+                    [names[i] for i in indices], [flat[i] for i in indices], model_id
+                ),
+                lambda row: row['rating']
             )
-            if rating is None:
-                rating = "Neutral"
+        # reduce: one row per conversation
+        rows = []
+        pos = 0
+        for fname, prompts in zip(filenames, parts):
+            rows.append(self.reduce_rows(fname, rated[pos:pos + len(prompts)]))
+            pos += len(prompts)
+        return rows
 
-            results.append({
+    def rate_prompts(self, filenames: list[str], prompts: list[FilledPrompt], model_id: str = MODEL_ID) -> list[dict]:
+        rows = []
+        if self.mode == "score":
+            distributions = score_options_batch(prompts, self.labels, batch_size=self.batch_size, model_id=model_id)
+            for fname, dist in zip(filenames, distributions):
+                rating = max(dist, key=dist.get)
+                print(f"Distribution for {fname}: {dist}\n")
+                rows.append({
+                    'task': self.task_name,
+                    'criterion': self.criterion,
+                    'filename': fname,
+                    'rating': rating,
+                    'score': sum(p * self.label_value(lab) for lab, p in dist.items()),
+                    'distribution': dist
+                })
+            return rows
+
+        if self.mode == "vote":
+            voted = vote(
+                # unreadable samples use up budget but give no vote (no "Neutral" fallback)
+                prompts, self.match_label,
+                samples_per_round=self.samples_per_round,
+                max_samples=self.max_samples,
+                max_new_tokens=self.vote_tokens,
+                batch_size=self.batch_size,
+                seed=self.seed,
+                stop=self.stop,
+                model_id=model_id
+            )
+            for fname, result in zip(filenames, voted):
+                dist = result['distribution']
+                print(f"Votes for {fname} after {result['samples']} samples: {dist}\n")
+                rows.append({
+                    'task': self.task_name,
+                    'criterion': self.criterion,
+                    'filename': fname,
+                    # no readable sample at all: "Neutral" like parse_response, with an
+                    # empty distribution (confidence 0 for a cascade)
+                    'rating': result['label'] or "Neutral",
+                    'score': sum(p * self.label_value(lab) for lab, p in dist.items()),
+                    'distribution': dist,
+                    'samples': result['samples']
+                })
+            return rows
+
+        responses = generate_texts(prompts, batch_size=self.batch_size, seed=self.seed, model_id=model_id)
+        for fname, response in zip(filenames, responses):
+            response = response.strip()
+            print(f"Response for {fname}:\n{response}\n")
+            rows.append({
                 'task': self.task_name,
                 'criterion': self.criterion,
                 'filename': fname,
-                'rating': rating
+                'rating': self.parse_response(response)
             })
+        return rows
+
+    def process(self, context: dict) -> dict:
+        results = context.setdefault('results', [])
+        filenames = context['filenames']
+        conversations = conversations_of(context)
+        rows = [
+            stored_row(self.store, self.task_name, self.criterion, fname, conv, self.params)
+            for fname, conv in zip(filenames, conversations)
+        ]
+        pending = [i for i, row in enumerate(rows) if row is None]
+        if self.store is not None:
+            print(f"{self.task_name}: {len(rows) - len(pending)} of {len(rows)} ratings taken from the store\n")
+        # with a store every finished batch is saved right away
+        chunk = self.batch_size if self.store is not None else max(len(pending), 1)
+        for start in range(0, len(pending), chunk):
+            indices = pending[start:start + chunk]
+            rated = self.rate([filenames[i] for i in indices], [conversations[i] for i in indices])
+            for i, row in zip(indices, rated):
+                store_row(self.store, row, conversations[i], self.params)
+                rows[i] = row
+        results.extend(rows)
+        return context
+
+
+class FusedClassifyStep(PipelineStep):
+    # Rates all criteria with a single prompt per conversation and a JSON answer.
+    # Criteria missing from the answer or with an unknown label are asked again
+    # one by one with the ClassifyStep prompt.
+    def __init__(self, tasks: list[tuple[str, str]], labels: list[str],
+                 batch_size: int = 8, seed: int | None = None, max_new_tokens: int = 400,
+                 store: ResultStore | None = None, max_prompt_tokens: int | None = None,
+                 reduce: dict[str, str] | None = None):
+        # conversations too long for one fused prompt are rated criterion by criterion
+        # in chunks, each criterion with its own reduce rule (default "majority")
+        reduce = reduce or {}
+        self.steps = [
+            ClassifyStep(name, criterion, labels, batch_size, seed,
+                         max_prompt_tokens=max_prompt_tokens, reduce=reduce.get(name, "majority"))
+            for name, criterion in tasks
+        ]
+        self.max_prompt_tokens = max_prompt_tokens
+        self.labels = labels
+        self.batch_size = batch_size
+        self.seed = seed
+        self.max_new_tokens = max_new_tokens
+        self.store = store
+        self.template = PromptTemplate(
+            "Conversation:\n{conversation}\n" +
+            literal(
+                "Rate the conversation above against each of these statements:" +
+                "".join(f"\n- {step.task_name}: {step.criterion}" for step in self.steps) +
+                "\nAnswer with a single JSON object that maps every statement name to exactly one of "
+                "the following options and nothing else:" +
+                "".join(f"\n- {lab}" for lab in self.labels)
+            )
+        )
+
+    @property
+    def params(self) -> dict:
+        params = {'labels': self.labels, 'mode': 'fused', 'seed': self.seed}
+        if self.max_prompt_tokens is not None:
+            params.update(max_prompt_tokens=self.max_prompt_tokens,
+                          reduce={step.task_name: step.reduce for step in self.steps})
+        return params
+
+    def fits(self, conversation: str) -> bool:
+        return self.max_prompt_tokens is None or count_tokens(self.build_prompt(conversation)) <= self.max_prompt_tokens
+
+    def fill_prompt(self, conversation: str) -> FilledPrompt:
+        return self.template.fill(conversation=conversation)
+
+    def build_prompt(self, conversation: str) -> str:
+        return self.fill_prompt(conversation).text
+
+    def parse_response(self, response: str) -> dict[str, str]:
+        answer = extract_json_object(response) or {}
+        ratings = {}
+        for step in self.steps:
+            rating = match_option(answer.get(step.task_name), self.labels)
+            if rating is not None:
+                ratings[step.task_name] = rating
+        return ratings
+
+    def rate(self, filenames: list[str], conversations: list[str]) -> list[dict[str, str]]:
+        long = [i for i, conv in enumerate(conversations) if not self.fits(conv)]
+        if long:
+            short = [i for i in range(len(conversations)) if i not in long]
+            ratings = [{} for _ in conversations]
+            if short:
+                rated = self.rate([filenames[i] for i in short], [conversations[i] for i in short])
+                for i, answer in zip(short, rated):
+                    ratings[i] = answer
+            for step in self.steps:
+                rows = step.rate([filenames[i] for i in long], [conversations[i] for i in long])
+                for i, row in zip(long, rows):
+                    ratings[i][step.task_name] = row['rating']
+            return ratings
+
+        responses = generate_texts(
+            [self.fill_prompt(conv) for conv in conversations],
+            max_new_tokens=self.max_new_tokens,
+            batch_size=self.batch_size,
+            seed=self.seed,
+            stop=[JSON_OBJECT_STOP]
+        )
+        ratings = []
+        for fname, response in zip(filenames, responses):
+            print(f"Response for {fname}:\n{response.strip()}\n")
+            ratings.append(self.parse_response(response))
+
+        missing = [
+            (i, step) for step in self.steps
+            for i in range(len(conversations)) if step.task_name not in ratings[i]
+        ]
+        if missing:
+            print(f"Fallback to single-criterion prompts for {len(missing)} ratings\n")
+            responses = generate_texts(
+                [step.fill_prompt(conversations[i]) for i, step in missing],
+                batch_size=self.batch_size,
+                seed=self.seed
+            )
+            for (i, step), response in zip(missing, responses):
+                ratings[i][step.task_name] = step.parse_response(response.strip())
+        return ratings
+
+    def process(self, context: dict) -> dict:
+        results = context.setdefault('results', [])
+        filenames = context['filenames']
+        conversations = conversations_of(context)
+        rows = {
+            (step.task_name, fname): stored_row(self.store, step.task_name, step.criterion, fname, conv, self.params)
+            for step in self.steps
+            for fname, conv in zip(filenames, conversations)
+        }
+        # a file is asked again as soon as one of its criteria is missing
+        pending = [
+            i for i, fname in enumerate(filenames)
+            if any(rows[step.task_name, fname] is None for step in self.steps)
+        ]
+        if self.store is not None:
+            print(f"{len(filenames) - len(pending)} of {len(filenames)} files fully rated in the store\n")
+        chunk = self.batch_size if self.store is not None else max(len(pending), 1)
+        for start in range(0, len(pending), chunk):
+            indices = pending[start:start + chunk]
+            rated = self.rate([filenames[i] for i in indices], [conversations[i] for i in indices])
+            for i, ratings in zip(indices, rated):
+                for step in self.steps:
+                    row = {
+                        'task': step.task_name,
+                        'criterion': step.criterion,
+                        'filename': filenames[i],
+                        'rating': ratings[step.task_name]
+                    }
+                    store_row(self.store, row, conversations[i], self.params)
+                    rows[step.task_name, filenames[i]] = row
+
+        # same row order as one ClassifyStep per criterion
+        for step in self.steps:
+            results.extend(rows[step.task_name, fname] for fname in filenames)
         return context
 
 
@@ -70,73 +461,142 @@ class ExtractScriptStyleStep(PipelineStep):
 
 
 class WriteCsvStep(PipelineStep):
-    def __init__(self, out_file: str):
+    def __init__(self, out_file: str, columnar: bool = False):
         self.out_file = out_file
+        # also write the ratings as NumPy columns (ratingAnalytics) next to the CSV
+        self.columnar = columnar
+
+    def write_columns(self):
+        if self.columnar:
+            from ratingAnalytics import RatingTable
+            RatingTable.from_csv(self.out_file).save_npz(os.path.splitext(self.out_file)[0] + ".npz")
+
+    @staticmethod
+    def extra_columns(rows: list[dict]) -> list[str]:
+        # Score and Samples only appear when some step produced them
+        return [key for key in ('score', 'samples') if any(key in row for row in rows)]
+
+    @staticmethod
+    def header(extra: list[str]) -> list[str]:
+        return ['Task', 'Criterion', 'Script', 'Style', 'Rating'] + [key.capitalize() for key in extra]
+
+    @staticmethod
+    def values(row: dict, extra: list[str]) -> list:
+        script_name = row.get('script', '')
+        style = row.get('style', '')
+        values = [
+            row['task'],
+            row['criterion'],
+            script_name,
+            style,
+            row['rating']
+        ]
+        return values + [row.get(key, '') for key in extra]
 
     def process(self, context: dict) -> dict:
+        rows = context.get('results', [])
+        extra = self.extra_columns(rows)
         with open(self.out_file, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(['Task', 'Criterion', 'Script', 'Style', 'Rating'])
-            for row in context.get('results', []):
-                script_name = row.get('script', '')
-                style = row.get('style', '')
-                writer.writerow([
-                    row['task'],
-                    row['criterion'],
-                    script_name,
-                    style,
-                    row['rating']
-                ])
+            writer.writerow(self.header(extra))
+            for row in rows:
+                writer.writerow(self.values(row, extra))
         print(f"CSV geschrieben: {self.out_file}")
+        self.write_columns()
         return context
 
+    def process_stream(self, items):
+        # rows are written chunk by chunk; the extra columns are decided by the first chunk
+        with open(self.out_file, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            extra = None
+            for context in items:
+                rows = context.get('results', [])
+                if extra is None:
+                    extra = self.extra_columns(rows)
+                    writer.writerow(self.header(extra))
+                for row in rows:
+                    writer.writerow(self.values(row, extra))
+                csvfile.flush()
+                yield context
+        print(f"CSV geschrieben: {self.out_file}")
+        self.write_columns()
+
+
+TASKS = [
+    (
+        "NonManTopic",
+        "The conversation between two women includes at least one topic other than a man."
+    ),
+    (
+        "ManTopic",
+        "The conversation includes a man as a topic."
+    ),
+    (
+        "WomenDialogue",
+        "Both women characters talk to each other."
+    ),
+    (
+        "ManFocused",
+        "The primary subject of the conversation is a specific man or men."
+    ),
+    (
+        "NotManFocused",
+        "The primary subject of the conversation is something else than a man."
+    ),
+    (
+        "IndirectMan",
+        "The conversation indirectly refers to a man and that topic is dominant."
+    ),
+    (
+        "SuperficialMan",
+        "The conversation only superficially mentions a man."
+    )
+]
+
+LABELS = [
+    "Fully matches",
+    "Largely matches",
+    "Neutral",
+    "Largely not matches",
+    "Does not match"
+]
+
 
 if __name__ == "__main__":
-    tasks = [
-        (
-            "NonManTopic",
-            "The conversation between two women includes at least one topic other than a man."
-        ),
-        (
-            "ManTopic",
-            "The conversation includes a man as a topic."
-        ),
-        (
-            "WomenDialogue",
-            "Both women characters talk to each other."
-        ),
-        (
-            "ManFocused",
-            "The primary subject of the conversation is a specific man or men."
-        ),
-        (
-            "NotManFocused",
-            "The primary subject of the conversation is something else than a man."
-        ),
-        (
-            "IndirectMan",
-            "The conversation indirectly refers to a man and that topic is dominant."
-        ),
-        (
-            "SuperficialMan",
-            "The conversation only superficially mentions a man."
-        )	
-    ]
-
-    labels = [
-        "Fully matches",
-        "Largely matches",
-        "Neutral",
-        "Largely not matches",
-        "Does not match"
-    ]
+    parser = argparse.ArgumentParser(description="Rate the conversations against the Bechdel criteria")
+    parser.add_argument("--cascade", action="store_true",
+                        help="also rate ManTopic with the 1B model first, unsure ratings with the default model")
+    parser.add_argument("--threshold", type=float, default=0.8, help="cascade: confidence below which to escalate")
+    args = parser.parse_args()
+    enable_prefix_cache()
+    enable_response_cache()
+    store = ResultStore("ratings.db")
 
     steps: list[PipelineStep] = []
     steps.append(LoadConversationsStep("data/conversations/*.txt"))
-    for name, criterion in tasks[3:5]:
-        steps.append(ClassifyStep(name, criterion, labels))
+    # how chunk ratings of long conversations are combined: a man mentioned in any
+    # part is a topic, superficial mentions have to hold throughout
+    reduce = {
+        "NonManTopic": "any",
+        "ManTopic": "any",
+        "WomenDialogue": "any",
+        "ManFocused": "majority",
+        "NotManFocused": "majority",
+        "IndirectMan": "majority",
+        "SuperficialMan": "all"
+    }
+    steps.append(FusedClassifyStep(TASKS[3:5], LABELS, seed=0, store=store, max_prompt_tokens=4096, reduce=reduce))
+    cascade = None
+    if args.cascade:
+        # the 1B model rates first, unsure ratings go to the 4B model
+        cascade = Cascade(threshold=args.threshold)
+        steps.append(ClassifyStep("ManTopic", TASKS[1][1], LABELS, seed=0, mode="score", store=store, cascade=cascade))
     steps.append(ExtractScriptStyleStep())
-    steps.append(WriteCsvStep("ratings.csv"))
+    steps.append(WriteCsvStep("ratings.csv", columnar=True))
 
     pipeline = Pipeline(steps)
-    pipeline.process({})
+    for _ in pipeline.run_streaming([{}]):
+        pass
+    if cascade is not None:
+        cascade.print_report()
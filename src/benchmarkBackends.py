@@ -0,0 +1,102 @@
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from bechdelPipeline import ClassifyStep
+from generationCore import tokenizer_of
+from generateText import generate_texts
+from modelRegistry import BACKENDS, get_model, set_backend
+
+CRITERIA = [
+    ("ManTopic", "The conversation includes a man as a topic."),
+    ("ManFocused", "The primary subject of the conversation is a specific man or men."),
+    ("NotManFocused", "The primary subject of the conversation is something else than a man."),
+]
+
+LABELS = [
+    "Fully matches",
+    "Largely matches",
+    "Neutral",
+    "Largely not matches",
+    "Does not match"
+]
+
+
+def run_worker(backend: str, pattern: str, max_new_tokens: int) -> dict:
+    os.environ.pop("RESPONSE_CACHE_DIR", None)
+    set_backend(backend)
+    start = time.perf_counter()
+    processor, _ = get_model()
+    load_seconds = time.perf_counter() - start
+
+    files = sorted(glob.glob(pattern))
+    steps = [ClassifyStep(name, criterion, LABELS) for name, criterion in CRITERIA]
+    jobs = []
+    prompts = []
+    for fname in files:
+        with open(fname, encoding='utf-8') as f:
+            conversation = f.read().strip()
+        for step in steps:
+            jobs.append((step, fname))
+            prompts.append(step.build_prompt(conversation))
+
+    start = time.perf_counter()
+    responses = generate_texts(prompts, max_new_tokens=max_new_tokens, do_sample=False)
+    seconds = time.perf_counter() - start
+
+    tokenizer = tokenizer_of(processor)
+    output_tokens = sum(len(tokenizer(r, add_special_tokens=False)["input_ids"]) for r in responses)
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "generate_seconds": seconds,
+        "output_tokens": output_tokens,
+        "tokens_per_second": output_tokens / seconds if seconds else 0.0,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "labels": {
+            f"{step.task_name}:{fname}": step.parse_response(response)
+            for (step, fname), response in zip(jobs, responses)
+        }
+    }
+
+
+def run_benchmark(backends: list[str], pattern: str, max_new_tokens: int, out_file: str) -> list[dict]:
+    results = []
+    for backend in backends:
+        # every backend in a fresh process, so peak RSS is not shared between them
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", backend, pattern, str(max_new_tokens)],
+            capture_output=True, text=True, check=True
+        )
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    baseline = next((r for r in results if r["backend"] == "bf16"), None)
+    for result in results:
+        if baseline is not None:
+            same = sum(result["labels"].get(k) == v for k, v in baseline["labels"].items())
+            result["label_agreement"] = same / len(baseline["labels"]) if baseline["labels"] else 1.0
+        print(
+            f"{result['backend']:>5}: {result['tokens_per_second']:.2f} tok/s, "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB, "
+            f"agreement {result.get('label_agreement', float('nan')):.2%}"
+        )
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark geschrieben: {out_file}")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        backend, pattern, max_new_tokens = sys.argv[2], sys.argv[3], int(sys.argv[4])
+        print(json.dumps(run_worker(backend, pattern, max_new_tokens)))
+    else:
+        backends = sys.argv[1:] or list(BACKENDS)
+        if "bf16" not in backends:
+            backends.insert(0, "bf16")
+        run_benchmark(backends, "data/conversations/*.txt", 200, "benchmark_backends.json")
@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ENTRY_POINTS = ("bechdelPipeline", "bechdelChoices", "filmSzene", "agentDialog")
+SIZES = (10, 1000, 100000)
+
+CRITERIA = [
+    ("ManTopic", "The conversation includes a man as a topic."),
+    ("ManFocused", "The primary subject of the conversation is a specific man or men."),
+    ("NotManFocused", "The primary subject of the conversation is something else than a man."),
+]
+
+LABELS = [
+    "Fully matches",
+    "Largely matches",
+    "Neutral",
+    "Largely not matches",
+    "Does not match"
+]
+
+NAMES = ["ANNA", "BETH", "CLARA", "DORA", "MR. HALL"]
+WORDS = ("the letter arrived late again and nobody knew who had sent it to the house "
+         "we should leave before the rain starts he said he would call but never did").split()
+
+
+def canned_answer(prompt: str) -> str:
+    # an answer each entry point can parse, so the benchmark walks its normal path
+    if "single JSON object" in prompt:
+        names = re.findall(r"^- (\w+): ", prompt, re.M) or re.findall(r"^(\w+): ", prompt, re.M)
+        value = "b" if "to the letter of its answer" in prompt else "Neutral"
+        return json.dumps({name: value for name in names})
+    if "Answer with a, b, or c." in prompt:
+        return "b) The second statement fits best."
+    if "[SCENE START]" in prompt:
+        return "[SCENE START]\nANNA: Where were you last night?\nBETH: Out. Walking.\n[SCENE END]"
+    if "Rate the conversation" in prompt:
+        return "The conversation touches the statement only in passing.\nLargely matches"
+    return "\"That sounds good to me, let us go on.\""
+
+
+def make_corpus(directory: str, size: int, seed: int = 0) -> str:
+    from filmSzene import STYLES
+
+    rng = random.Random(seed)
+    styles = [style.lower().replace(" ", "_") for style in STYLES]
+    os.makedirs(directory, exist_ok=True)
+    for i in range(size):
+        lines = [
+            f"{rng.choice(NAMES)}: {' '.join(rng.choices(WORDS, k=rng.randint(4, 14)))}"
+            for _ in range(rng.randint(6, 20))
+        ]
+        with open(os.path.join(directory, f"script{i}_{styles[i % len(styles)]}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+    return directory
+
+
+class StageTimer:
+    # Wall time and mock-backend counters per named stage. Stages may nest (a
+    # wrapped method inside a timed block); the outer stage then includes the inner.
+    def __init__(self, backend):
+        self.backend = backend
+        self.stages: dict[str, dict] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items: int = 0):
+        before = self.backend.snapshot()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            after = self.backend.snapshot()
+            stats = self.stages.setdefault(name, {
+                "wall_seconds": 0.0, "entries": 0, "items": 0, "calls": 0, "prompts": 0,
+                "prompt_tokens": 0, "output_tokens": 0, "model_seconds": 0.0
+            })
+            stats["wall_seconds"] += wall
+            stats["entries"] += 1
+            stats["items"] += items
+            for key in ("calls", "prompts", "prompt_tokens", "output_tokens"):
+                stats[key] += after[key] - before[key]
+            stats["model_seconds"] += after["busy_seconds"] - before["busy_seconds"]
+
+    def wrap(self, owner, attr: str, name: str | None = None):
+        original = getattr(owner, attr)
+
+        def timed(*args, **kwargs):
+            with self.stage(name or attr):
+                return original(*args, **kwargs)
+
+        setattr(owner, attr, timed)
+
+    def report(self) -> dict:
+        for stats in self.stages.values():
+            wall = stats["wall_seconds"]
+            stats["orchestration_seconds"] = max(0.0, wall - stats["model_seconds"])
+            stats["items_per_second"] = stats["items"] / wall if wall else 0.0
+            stats["tokens_per_second"] = (stats["prompt_tokens"] + stats["output_tokens"]) / wall if wall else 0.0
+        return self.stages
+
+
+def bench_bechdel_pipeline(corpus_dir: str, work_dir: str, size: int, timer: StageTimer):
+    from bechdelPipeline import (
+        ClassifyStep, ExtractScriptStyleStep, FusedClassifyStep, LoadConversationsStep, WriteCsvStep
+    )
+    from corpusStore import Corpus
+
+    with timer.stage("load"):
+        corpus = Corpus(corpus_dir, manifest=os.path.join(work_dir, "manifest.json"))
+        context = LoadConversationsStep(corpus).process({})
+    n = len(context['filenames'])
+    steps = [(f"classify:{name}", ClassifyStep(name, criterion, LABELS)) for name, criterion in CRITERIA]
+    steps += [
+        ("classify:fused", FusedClassifyStep(CRITERIA, LABELS)),
+        ("extract", ExtractScriptStyleStep()),
+        ("write_csv", WriteCsvStep(os.path.join(work_dir, "ratings.csv")))
+    ]
+    for name, step in steps:
+        with timer.stage(name, items=n):
+            context = step.process(context)
+
+
+def bench_bechdel_choices(corpus_dir: str, work_dir: str, size: int, timer: StageTimer):
+    from bechdelChoices import SimpleBechdelPipeline, StatementSet
+
+    sets = [
+        StatementSet('Women', 'Which statement best describes who is speaking?',
+                     ['Both women are talking.', 'Only one woman is talking.', 'No woman is talking.']),
+        StatementSet('Subject', 'Which statement fits the primary subject?',
+                     ['Something else than a man.', 'A man and something else.', 'A specific man.'], mode="score"),
+    ]
+    for fused in (False, True):
+        label = "fused" if fused else "single"
+        pipeline = SimpleBechdelPipeline(corpus_dir, os.path.join(work_dir, f"choices_{label}.csv"), sets, fused=fused)
+        timer.wrap(pipeline, "rate", f"{label}:rate")
+        timer.wrap(pipeline, "rate_fused", f"{label}:rate_fused")
+        with timer.stage(f"{label}:run", items=size * len(sets)):
+            pipeline.run()
+
+
+def bench_film_szene(corpus_dir: str, work_dir: str, size: int, timer: StageTimer):
+    import filmSzene
+
+    # size // len(STYLES) scripts keep the number of generated scenes near size
+    scripts_dir = os.path.join(work_dir, "scripts")
+    os.makedirs(scripts_dir, exist_ok=True)
+    for name in sorted(os.listdir(corpus_dir))[:max(1, size // len(filmSzene.STYLES))]:
+        shutil.copy(os.path.join(corpus_dir, name), scripts_dir)
+    with timer.stage("load"):
+        scripts = filmSzene.load_scripts(scripts_dir)
+    timer.wrap(filmSzene, "save_script", "save")
+    with timer.stage("generate_scenes", items=len(scripts) * len(filmSzene.STYLES)):
+        filmSzene.generate_scenes(scripts, output_dir=os.path.join(work_dir, "scenes"))
+
+
+def bench_agent_dialog(corpus_dir: str, work_dir: str, size: int, timer: StageTimer):
+    import agentDialog
+
+    # the dialog is not corpus driven: size sets the number of rounds, capped since
+    # every prompt carries the whole dialog so far
+    rounds = min(size, 500)
+    random.seed(0)
+    agents = [
+        agentDialog.Agent(name, [f"topic {i}" for i in range(rounds)], f"{name} likes to talk.",
+                          special_actions={"summary": 0.05, "probe": 0.05})
+        for name in ("Alice", "Bob", "Eve")
+    ]
+    with timer.stage("dialog", items=rounds):
+        agentDialog.run_dialog_simulation(agents, max_rounds=rounds)
+
+
+RUNNERS = {
+    "bechdelPipeline": bench_bechdel_pipeline,
+    "bechdelChoices": bench_bechdel_choices,
+    "filmSzene": bench_film_szene,
+    "agentDialog": bench_agent_dialog,
+}
+
+
+def run_worker(entry: str, size: int, corpus_dir: str, mock: dict) -> dict:
+    import corpusStore
+    from mockBackend import MockBackend
+
+    os.environ.pop("RESPONSE_CACHE_DIR", None)
+    os.environ.pop("INFERENCE_SERVER_URL", None)
+    backend = MockBackend(answer=canned_answer, **mock).install()
+    timer = StageTimer(backend)
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{entry}_")
+    # corpora the entry points open themselves keep their manifests in work_dir, not
+    # in the repository's .cache/corpus (the module reads CORPUS_CACHE_DIR on import)
+    corpusStore.MANIFEST_DIR = os.path.join(work_dir, "corpus")
+    start = time.perf_counter()
+    try:
+        # the entry points print every answer, which would dominate the timings
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            RUNNERS[entry](corpus_dir, work_dir, size, timer)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    wall = time.perf_counter() - start
+    totals = backend.snapshot()
+    return {
+        "entry": entry,
+        "size": size,
+        "wall_seconds": wall,
+        "model_seconds": totals["busy_seconds"],
+        "orchestration_seconds": max(0.0, wall - totals["busy_seconds"]),
+        "calls": totals["calls"],
+        "prompts": totals["prompts"],
+        "prompt_tokens": totals["prompt_tokens"],
+        "output_tokens": totals["output_tokens"],
+        "prompts_per_second": totals["prompts"] / wall if wall else 0.0,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": timer.report()
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(entries: list[str], sizes: list[int], mock: dict, out_file: str) -> dict:
+    results = []
+    corpus_root = tempfile.mkdtemp(prefix="bench_corpus_")
+    try:
+        for size in sizes:
+            corpus_dir = make_corpus(os.path.join(corpus_root, str(size)), size)
+            for entry in entries:
+                # every run in a fresh process, so peak RSS belongs to that run alone
+                proc = subprocess.run(
+                    [sys.executable, __file__, "--worker", entry, str(size), corpus_dir, json.dumps(mock)],
+                    capture_output=True, text=True, check=True
+                )
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+                results.append(result)
+                print(
+                    f"{entry:>16} {size:>7}: {result['wall_seconds']:8.2f} s, "
+                    f"orchestration {result['orchestration_seconds']:8.2f} s, "
+                    f"{result['calls']} calls, {result['prompts_per_second']:.0f} prompts/s, "
+                    f"peak RSS {result['peak_rss_mb']:.0f} MB"
+                )
+    finally:
+        shutil.rmtree(corpus_root, ignore_errors=True)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "mock": mock,
+        "results": results
+    }
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark geschrieben: {out_file}")
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        entry, size, corpus_dir, mock = sys.argv[2], int(sys.argv[3]), sys.argv[4], json.loads(sys.argv[5])
+        print(json.dumps(run_worker(entry, size, corpus_dir, mock)))
+    else:
+        parser = argparse.ArgumentParser(description="Orchestration benchmark with a mock model backend")
+        parser.add_argument("--entries", nargs="+", choices=ENTRY_POINTS, default=list(ENTRY_POINTS))
+        parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES))
+        parser.add_argument("--latency", type=float, default=0.0, help="mean seconds per model call")
+        parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per output token")
+        parser.add_argument("--distribution", choices=("fixed", "exponential", "lognormal"), default="fixed")
+        parser.add_argument("--out", default="benchmark_suite.json")
+        args = parser.parse_args()
+        run_suite(
+            args.entries,
+            args.sizes,
+            {"latency": args.latency, "token_latency": args.token_latency, "distribution": args.distribution},
+            args.out
+        )
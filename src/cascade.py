@@ -0,0 +1,80 @@
+import random
+import threading
+from typing import Callable
+
+from modelRegistry import MODEL_ID
+
+SMALL_MODEL_ID = "google/gemma-3-1b-it"
+
+
+class Cascade:
+    # Rates with the small model first and asks the large model only where the
+    # small one is unsure: its top label share (score probability or vote share)
+    # stays below threshold. A random share `audit` of the confident ratings is
+    # asked again as well, so the agreement also covers what was not escalated.
+    def __init__(self, small_model: str = SMALL_MODEL_ID, large_model: str = MODEL_ID,
+                 threshold: float = 0.8, audit: float = 0.0, seed: int = 0):
+        if not 0.0 <= threshold <= 1.0:
+            raise ValueError(f"Threshold must be between 0 and 1: {threshold}")
+        self.small_model = small_model
+        self.large_model = large_model
+        self.threshold = threshold
+        self.audit = audit
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats: dict[str, dict[str, int]] = {}
+
+    @property
+    def params(self) -> dict:
+        return {'small_model': self.small_model, 'large_model': self.large_model, 'threshold': self.threshold}
+
+    @staticmethod
+    def confidence(row: dict) -> float:
+        distribution = row.get('distribution') or {}
+        return max(distribution.values(), default=0.0)
+
+    def run(self, names: list[str], rate: Callable[[list[int], str], list[dict]],
+            label: Callable[[dict], str]) -> list[dict]:
+        # names[i] is the task of item i (for the report); rate(indices, model_id)
+        # rates those items with one model and returns rows with a distribution
+        rows = rate(list(range(len(names))), self.small_model)
+        escalate = [i for i, row in enumerate(rows) if self.confidence(row) < self.threshold]
+        escalated = set(escalate)
+        with self._lock:
+            audited = [i for i in range(len(rows)) if i not in escalated and self._rng.random() < self.audit]
+        asked = escalate + audited
+        large_rows = dict(zip(asked, rate(asked, self.large_model))) if asked else {}
+
+        with self._lock:
+            for name in names:
+                self._counter(name)['rated'] += 1
+            for i, large in large_rows.items():
+                stats = self._counter(names[i])
+                stats['escalated' if i in escalated else 'audited'] += 1
+                stats['compared'] += 1
+                stats['agreed'] += label(rows[i]) == label(large)
+        return [
+            {**large_rows[i], 'model': self.large_model} if i in escalated else {**row, 'model': self.small_model}
+            for i, row in enumerate(rows)
+        ]
+
+    def _counter(self, name: str) -> dict[str, int]:
+        return self.stats.setdefault(name, {'rated': 0, 'escalated': 0, 'audited': 0, 'compared': 0, 'agreed': 0})
+
+    def report(self) -> dict[str, dict]:
+        report = {}
+        with self._lock:
+            for name, stats in sorted(self.stats.items()):
+                report[name] = {
+                    **stats,
+                    'escalation_rate': stats['escalated'] / stats['rated'] if stats['rated'] else 0.0,
+                    'agreement': stats['agreed'] / stats['compared'] if stats['compared'] else None
+                }
+        return report
+
+    def print_report(self):
+        print(f"Cascade {self.small_model} -> {self.large_model}, threshold {self.threshold}")
+        for name, stats in self.report().items():
+            agreement = "-" if stats['agreement'] is None else f"{stats['agreement']:.0%}"
+            print(f"{name}: {stats['escalated']} of {stats['rated']} escalated ({stats['escalation_rate']:.0%}), "
+                  f"agreement {agreement} over {stats['compared']} compared")
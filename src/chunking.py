@@ -0,0 +1,103 @@
+import re
+from collections import Counter
+from typing import Callable
+
+from generationCore import count_tokens
+
+REDUCE_RULES = ("any", "all", "majority", "mean")
+
+SCENE_LINE = re.compile(r'^\s*(?:\*\*)?\s*(?:INT\.|EXT\.|INT/EXT|\[SCENE)', re.IGNORECASE)
+SPEAKER_LINE = re.compile(r"^\s*(?:\*\*[A-Z][A-Z0-9 .'-]{0,40}\*\*\s*$|[A-Z][A-Za-z0-9 .'-]{0,40}:)")
+
+
+def split_units(text: str) -> list[tuple[str, bool]]:
+    # (unit, starts_scene): a unit is one speaker's turn with its stage directions;
+    # scene headings go with the turn that follows them, so none is a chunk of its own
+    units: list[tuple[str, bool]] = []
+    current: list[str] = []
+    scene = False
+    for line in text.splitlines():
+        is_scene = bool(SCENE_LINE.match(line))
+        heading_only = all(SCENE_LINE.match(part) for part in current if part.strip())
+        if (is_scene or SPEAKER_LINE.match(line)) and any(part.strip() for part in current) and not heading_only:
+            units.append(("\n".join(current).strip(), scene))
+            current = []
+            scene = False
+        scene = scene or is_scene
+        current.append(line)
+    if any(part.strip() for part in current):
+        units.append(("\n".join(current).strip(), scene))
+    return units
+
+
+def _fit(unit: str, max_tokens: int, count: Callable[[str], int]) -> list[str]:
+    # a single turn longer than the budget is cut at line and then at character level
+    if count(unit) <= max_tokens:
+        return [unit]
+    pieces, current = [], ""
+    for line in unit.splitlines():
+        candidate = f"{current}\n{line}" if current else line
+        if current and count(candidate) > max_tokens:
+            pieces.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        pieces.append(current)
+    width = max(1, max_tokens * 4)
+    return [piece[i:i + width] for piece in pieces for i in range(0, len(piece), width)]
+
+
+def chunk_text(text: str, max_tokens: int, overlap: int = 1,
+               count: Callable[[str], int] = count_tokens) -> list[str]:
+    # Packs units into chunks of at most max_tokens, separators included. A new scene
+    # starts a new chunk once the current one is half full; otherwise the last
+    # `overlap` turns are repeated at the start of the next chunk so replies keep
+    # their context.
+    if count(text) <= max_tokens:
+        return [text]
+    units = []
+    for unit, scene in split_units(text):
+        for i, piece in enumerate(_fit(unit, max_tokens, count)):
+            units.append((piece, scene and i == 0, count(piece)))
+
+    sep = count("\n\n")
+    chunks: list[str] = []
+    current: list[tuple[str, bool, int]] = []
+    size = 0
+    for unit in units:
+        _, scene, n = unit
+        if current and (size + sep + n > max_tokens or (scene and size > max_tokens // 2)):
+            chunks.append("\n\n".join(u[0] for u in current))
+            current = [] if scene or not overlap else current[-overlap:]
+            size = sum(u[2] for u in current) + sep * max(0, len(current) - 1)
+            if current and size + sep + n > max_tokens:
+                current, size = [], 0
+        size += n + (sep if current else 0)
+        current.append(unit)
+    if current:
+        chunks.append("\n\n".join(u[0] for u in current))
+    return chunks
+
+
+def reduce_values(rule: str, values: list[float]) -> float:
+    # values run from 1.0 (the first label or statement applies) down to -1.0
+    if rule == "any":
+        return max(values)
+    if rule == "all":
+        return min(values)
+    if rule == "majority":
+        counts = Counter(values)
+        top = max(counts.values())
+        tied = [value for value, n in counts.items() if n == top]
+        return sum(tied) / len(tied)
+    if rule == "mean":
+        return sum(values) / len(values)
+    raise ValueError(f"Unknown reduce rule: {rule} (choose from {', '.join(REDUCE_RULES)})")
+
+
+def mean_distribution(distributions: list[dict[str, float]]) -> dict[str, float]:
+    total: dict[str, float] = {}
+    for dist in distributions:
+        for label, p in dist.items():
+            total[label] = total.get(label, 0.0) + p / len(distributions)
+    return total
@@ -0,0 +1,177 @@
+import fnmatch
+import hashlib
+import json
+import mmap
+import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+# next to the sources, not the working directory: runs from src/ and from the repo
+# root share one manifest (CORPUS_CACHE_DIR overrides it)
+MANIFEST_DIR = os.getenv("CORPUS_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "corpus"
+)
+
+
+class Corpus:
+    # A directory or .zip/.tar archive of text documents, scanned once. The manifest
+    # (path, size, mtime, hash) is kept on disk so a rescan only reads documents whose
+    # size or mtime changed; texts are read lazily and the recent ones kept in memory.
+    def __init__(self, source: str, pattern: str = "*.txt", manifest: str | None = None,
+                 cache_size: int = 256):
+        self.source = source
+        self.pattern = pattern
+        self.cache_size = cache_size
+        self.manifest_path = manifest or os.path.join(
+            MANIFEST_DIR, hashlib.sha256(f"{os.path.abspath(source)}|{pattern}".encode()).hexdigest()[:16] + ".json"
+        )
+        self._texts: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._archive = None
+        self.entries: dict[str, dict] = {}
+        # path -> the kept path with the same content, filled by paths(unique=True)
+        self.duplicates: dict[str, str] = {}
+        self.read_count = 0
+        self.kind = self._detect_kind()
+        self.scan()
+
+    @classmethod
+    def from_pattern(cls, pattern: str, **kwargs) -> "Corpus":
+        # "data/conversations/*.txt" -> directory and file pattern
+        directory, name = os.path.split(pattern)
+        return cls(directory or ".", name or "*.txt", **kwargs)
+
+    def _detect_kind(self) -> str:
+        if os.path.isdir(self.source):
+            return "dir"
+        if zipfile.is_zipfile(self.source):
+            return "zip"
+        if tarfile.is_tarfile(self.source):
+            return "tar"
+        raise ValueError(f"Not a directory or archive: {self.source}")
+
+    def _open_archive(self):
+        if self._archive is None:
+            if self.kind == "zip":
+                self._archive = zipfile.ZipFile(self.source)
+            else:
+                self._archive = tarfile.open(self.source)
+        return self._archive
+
+    def _listing(self):
+        # (name, size, mtime) of every matching document, without reading it
+        if self.kind == "dir":
+            with os.scandir(self.source) as it:
+                for entry in it:
+                    if entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern):
+                        stat = entry.stat()
+                        yield entry.name, stat.st_size, stat.st_mtime_ns
+        elif self.kind == "zip":
+            for info in self._open_archive().infolist():
+                if not info.is_dir() and fnmatch.fnmatch(os.path.basename(info.filename), self.pattern):
+                    yield info.filename, info.file_size, list(info.date_time)
+        else:
+            for member in self._open_archive().getmembers():
+                if member.isfile() and fnmatch.fnmatch(os.path.basename(member.name), self.pattern):
+                    yield member.name, member.size, member.mtime
+
+    def _read_bytes(self, name: str) -> bytes:
+        self.read_count += 1
+        if self.kind == "zip":
+            return self._open_archive().read(name)
+        if self.kind == "tar":
+            return self._open_archive().extractfile(name).read()
+        with open(os.path.join(self.source, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return manifest.get("entries", {}) if manifest.get("source") == os.path.abspath(self.source) else {}
+
+    def save_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"source": os.path.abspath(self.source), "entries": self.entries}, f)
+        os.replace(tmp, self.manifest_path)
+
+    def scan(self):
+        known = self._load_manifest()
+        entries = {}
+        changed = False
+        with self._lock:
+            for name, size, mtime in self._listing():
+                entry = known.get(name)
+                if entry is None or entry["size"] != size or entry["mtime"] != mtime:
+                    data = self._read_bytes(name)
+                    entry = {"size": size, "mtime": mtime, "hash": hashlib.sha256(data).hexdigest()}
+                    self._remember(self.path(name), data)
+                    changed = True
+                entries[name] = entry
+        changed = changed or entries.keys() != known.keys()
+        self.entries = dict(sorted(entries.items()))
+        if changed:
+            self.save_manifest()
+
+    def _remember(self, path: str, data: bytes):
+        self._texts[path] = data.decode("utf-8").strip()
+        self._texts.move_to_end(path)
+        while len(self._texts) > self.cache_size:
+            self._texts.popitem(last=False)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.source, name)
+
+    def name(self, path: str) -> str:
+        return os.path.relpath(path, self.source)
+
+    def paths(self, unique: bool = False) -> list[str]:
+        # unique=True keeps only the first document of every distinct content
+        if not unique:
+            return [self.path(name) for name in self.entries]
+        seen: dict[str, str] = {}
+        paths = []
+        self.duplicates = {}
+        for name, entry in self.entries.items():
+            if entry["hash"] in seen:
+                self.duplicates[self.path(name)] = seen[entry["hash"]]
+            else:
+                seen[entry["hash"]] = self.path(name)
+                paths.append(self.path(name))
+        if self.duplicates:
+            print(f"Skipping {len(self.duplicates)} of {len(self.entries)} documents in {self.source} "
+                  f"as duplicates, e.g. {self.name(next(iter(self.duplicates)))}")
+        return paths
+
+    def content_hash(self, path: str) -> str:
+        return self.entries[self.name(path)]["hash"]
+
+    def text(self, path: str) -> str:
+        with self._lock:
+            if path in self._texts:
+                self._texts.move_to_end(path)
+                return self._texts[path]
+            data = self._read_bytes(self.name(path))
+            self._remember(path, data)
+            return self._texts[path]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        for path in self.paths():
+            yield path, self.text(path)
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
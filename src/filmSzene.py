@@ -1,70 +1,393 @@
+import argparse
+import hashlib
+import importlib.util
+import json
 import os
+import queue
+import threading
+import time
+from typing import Iterator
 
-from generateText import generate_text
+from corpusStore import Corpus
+from generateText import enable_response_cache, generate_texts
+from generationCore import count_tokens
+from resultStore import model_key
+from sceneManifest import append_record, latest, manifest_path, read_manifest, text_hash
+
+SCENE_START = "[SCENE START]"
+SCENE_END = "[SCENE END]"
+
+STYLES = [
+    "1970s arthouse cinema",
+    "Italian neorealism",
+    "1940s Screw ball comedy",
+    "Danish Dogme 95",
+    "Film noir",
+    "Shakespearean",
+    "Anime"
+]
+
+SCENE_BRIEF_MAP = {
+    "1970s arthouse cinema": "In a sun-dappled living room.",
+    "Italian neorealism": (
+        "In a humble Roman courtyard at dusk, two women, both washerwomen worn thin by hardship, "
+        "sit among faded stone walls and scattered laundry."
+    ),
+    "1940s Screw ball comedy": ("In a sun-dappled living room. There is a table with a vase of flowers and two glasses of martini."),
+    "Danish Dogme 95": (
+        "In a stark, minimalist apartment, two friends engage in a heated discussion about life choices."
+    ),
+    "Film noir": (
+        "On a rain-slicked back alley at midnight, two women trade terse threats. The air is thick with tension, "
+        "and the distant sound of sirens echoes."
+    ),
+    "Shakespearean": (
+        "In a grand castle hall, two noblewomen engage in a witty exchange, their words laced with double meanings and hidden agendas."
+    ),
+    "Anime": (
+        "In a vibrant, bustling city street, two friends, one with bright pink hair and the other with blue, engage in a lively conversation."
+    ),
+}
+
+def script_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
 
 def load_scripts(script_dir: str = "./data/scripts") -> dict:
-    scripts = {}
-    for filename in sorted(os.listdir(script_dir)):
-        if filename.endswith(".txt"):
-            name = os.path.splitext(filename)[0]
-            path = os.path.join(script_dir, filename)
-            with open(path, "r", encoding="utf-8") as f:
-                scripts[name] = f.read().strip()
-    return scripts
-
-def save_script(content: str, script_name: str, style: str, output_dir: str = "./data/output-2"):
+    # script_dir may also be a .zip or .tar archive
+    return {script_name(path): text for path, text in Corpus(script_dir, "*.txt")}
+
+def load_styles(path: str = __file__) -> tuple[list, dict]:
+    # STYLES and SCENE_BRIEF_MAP as currently saved in this file, without restarting
+    spec = importlib.util.spec_from_file_location("_film_szene_styles", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.STYLES, module.SCENE_BRIEF_MAP
+
+def scene_filename(script_name: str, style: str) -> str:
     safe_style = style.lower().replace(" ", "_").replace(",", "")
     safe_name = script_name.lower().replace(" ", "_")
+    return f"{safe_name}_{safe_style}.txt"
+
+def strip_scene_markers(text: str) -> str:
+    # the scene between the markers the prompt asks for; they end generation but are
+    # not part of the saved scene
+    start = text.find(SCENE_START)
+    if start != -1:
+        text = text[start + len(SCENE_START):]
+    end = text.find(SCENE_END)
+    if end != -1:
+        text = text[:end]
+    return text.strip()
+
+def save_script(content: str, script_name: str, style: str, output_dir: str = "./data/output-2") -> str:
     os.makedirs(output_dir, exist_ok=True)
-    filename = f"{safe_name}_{safe_style}.txt"
-    path = os.path.join(output_dir, filename)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
+    path = os.path.join(output_dir, scene_filename(script_name, style))
+    # written under a temporary name first, so an interrupted run leaves no half scene
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(strip_scene_markers(content))
+    os.replace(path + ".tmp", path)
     print(f"Saved {path}")
+    return path
 
-if __name__ == "__main__":
-    styles = [
-        "1970s arthouse cinema",
-        "Italian neorealism",
-        "1940s Screw ball comedy",
-        "Danish Dogme 95",
-        "Film noir",
-        "Shakespearean",
-        "Anime"
-    ]
-
-    scene_brief_map = {
-        "1970s arthouse cinema": "In a sun-dappled living room.",
-        "Italian neorealism": (
-            "In a humble Roman courtyard at dusk, two women, both washerwomen worn thin by hardship, "
-            "sit among faded stone walls and scattered laundry."
-        ),
-        "1940s Screw ball comedy": ("In a sun-dappled living room. There is a table with a vase of flowers and two glasses of martini."),
-        "Danish Dogme 95": (
-            "In a stark, minimalist apartment, two friends engage in a heated discussion about life choices."
-        ),
-        "Film noir": (
-            "On a rain-slicked back alley at midnight, two women trade terse threats. The air is thick with tension, "
-            "and the distant sound of sirens echoes."
-        ),
-        "Shakespearean": (
-            "In a grand castle hall, two noblewomen engage in a witty exchange, their words laced with double meanings and hidden agendas."
-        ),
-        "Anime": (
-            "In a vibrant, bustling city street, two friends, one with bright pink hair and the other with blue, engage in a lively conversation."
-        ),
-    }
-
-    scripts = load_scripts()
-
-    for script_name, full_desc in scripts.items():
-        for style in styles:
-            brief_desc = scene_brief_map[style]
-            prompt = (
-                f"Generate a dialogue scene in the style of {style} based on the following scene description:\n"
-                f"{brief_desc}\n{full_desc}\n\n"
-                f"Stick to the scene description and the style, don't add additional personalities or plot.\n"
-                "Dialogue:"
+def build_prompt(style: str, brief_desc: str, full_desc: str) -> str:
+    return (
+        f"Generate a dialogue scene in the style of {style} based on the following scene description:\n"
+        f"{brief_desc}\n{full_desc}\n\n"
+        f"Stick to the scene description and the style, don't add additional personalities or plot.\n"
+        f"Begin with {SCENE_START} and end the scene with {SCENE_END}.\n"
+        "Dialogue:"
+    )
+
+class SceneJob:
+    def __init__(self, script_name: str, style: str, prompt: str, params: dict):
+        self.script_name = script_name
+        self.style = style
+        self.prompt = prompt
+        self.filename = scene_filename(script_name, style)
+        # everything the scene depends on: the prompt (style, brief and script) and the
+        # generation settings
+        self.params_hash = hashlib.sha256(
+            json.dumps({**params, 'prompt': prompt}, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def advance(self, n: int) -> str:
+        with self._lock:
+            self.done += n
+            elapsed = time.perf_counter() - self.start
+            eta = elapsed / self.done * (self.total - self.done) if self.done else 0.0
+            return (f"[{self.done}/{self.total}] {self.done / self.total:.0%}, "
+                    f"{elapsed:.0f} s elapsed, ETA {eta:.0f} s")
+
+class SceneScheduler:
+    # Expands scripts x styles into jobs and generates only the scenes whose output
+    # is missing or was made with other parameters. The jobs of one script are
+    # batched into one call; `concurrency` groups are in flight at a time. Every
+    # finished scene is recorded in the manifest (sceneManifest) with its timings
+    # and sizes, so an interrupted run picks up where it stopped.
+
+    def __init__(self, scripts: dict, styles: list = STYLES, scene_brief_map: dict = SCENE_BRIEF_MAP,
+                 output_dir: str = "./data/output-2", concurrency: int = 1, batch_size: int = 8,
+                 seed: int | None = 0, max_new_tokens: int = 1000, temperature: float = 0.8, force: bool = False):
+        self.scripts = scripts
+        self.styles = styles
+        self.scene_brief_map = scene_brief_map
+        self.output_dir = output_dir
+        self.concurrency = max(1, concurrency)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.force = force
+
+    @property
+    def params(self) -> dict:
+        # batch_size too: the seed applies per batch, so it changes the samples
+        return {'model': model_key(), 'seed': self.seed, 'max_new_tokens': self.max_new_tokens,
+                'temperature': self.temperature, 'stop': [SCENE_END], 'batch_size': self.batch_size}
+
+    @property
+    def manifest_path(self) -> str:
+        return manifest_path(self.output_dir)
+
+    def jobs(self) -> list[SceneJob]:
+        params = self.params
+        return [
+            SceneJob(script_name, style, build_prompt(style, self.scene_brief_map[style], full_desc), params)
+            for script_name, full_desc in self.scripts.items()
+            for style in self.styles
+        ]
+
+    def finished(self) -> dict[str, dict]:
+        # filename -> latest manifest record
+        return latest(read_manifest(self.manifest_path))
+
+    def pending(self, jobs: list[SceneJob]) -> list[SceneJob]:
+        if self.force:
+            return jobs
+        finished = self.finished()
+        return [
+            job for job in jobs
+            if finished.get(job.filename, {}).get('params') != job.params_hash
+            or not os.path.exists(os.path.join(self.output_dir, job.filename))
+        ]
+
+    def groups(self, jobs: list[SceneJob]) -> list[list[SceneJob]]:
+        # jobs of the same script together, at most batch_size per group
+        by_script: dict[str, list[SceneJob]] = {}
+        for job in jobs:
+            by_script.setdefault(job.script_name, []).append(job)
+        return [
+            script_jobs[i:i + self.batch_size]
+            for script_jobs in by_script.values()
+            for i in range(0, len(script_jobs), self.batch_size)
+        ]
+
+    def record(self, job: SceneJob, output: str, timing: dict, batch: int):
+        # the token counts of the generation where the local model ran it; cached,
+        # remote and mock answers only have the len/4 estimate and are marked as such
+        exact = timing.get('prompt_tokens') is not None
+        append_record(self.manifest_path, {
+            'file': job.filename,
+            'params': job.params_hash,
+            'script': job.script_name,
+            'style': job.style,
+            'prompt_hash': text_hash(job.prompt),
+            'sampling': self.params,
+            'prompt_tokens': timing['prompt_tokens'] if exact else count_tokens(job.prompt),
+            'output_tokens': timing['output_tokens'] if exact else count_tokens(output),
+            'estimated': not exact,
+            'ttft': timing['ttft'],
+            'latency': timing['latency'],
+            'cached': timing['cached'],
+            'batch': batch,
+            'output_hash': text_hash(output),
+            'time': time.time()
+        })
+
+    def run_group(self, group: list[SceneJob]) -> list[tuple[str, str]]:
+        # (path, text) of every saved scene
+        timings: list[dict] = []
+        outputs = generate_texts(
+            [job.prompt for job in group],
+            max_new_tokens=self.max_new_tokens,
+            temperature=self.temperature,
+            batch_size=self.batch_size,
+            seed=self.seed,
+            stop=[SCENE_END],
+            timings=timings
+        )
+        scenes = []
+        for job, output, timing in zip(group, outputs, timings):
+            output = strip_scene_markers(output)
+            path = save_script(output, script_name=job.script_name, style=job.style, output_dir=self.output_dir)
+            self.record(job, output, timing, len(group))
+            scenes.append((path, output))
+        return scenes
+
+    def plan(self) -> tuple[list[SceneJob], list[SceneJob]]:
+        # all jobs and the ones still to generate
+        jobs = self.jobs()
+        todo = self.pending(jobs)
+        print(f"{len(jobs)} scenes, {len(jobs) - len(todo)} up to date, {len(todo)} to generate")
+        return jobs, todo
+
+    def stream(self, todo: list[SceneJob]) -> Iterator[list[tuple[str, str]]]:
+        # the scenes of every finished group as soon as it is saved; the workers wait
+        # while `concurrency` groups are not taken yet
+        os.makedirs(self.output_dir, exist_ok=True)
+        progress = Progress(len(todo))
+        tasks: queue.Queue = queue.Queue()
+        for group in self.groups(todo):
+            tasks.put(group)
+        results: queue.Queue = queue.Queue(maxsize=self.concurrency)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def worker():
+            try:
+                while not stop.is_set():
+                    try:
+                        group = tasks.get_nowait()
+                    except queue.Empty:
+                        break
+                    scenes = self.run_group(group)
+                    print(progress.advance(len(group)))
+                    put(scenes)
+            except BaseException as exc:
+                put(exc)
+            put(None)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(self.concurrency, tasks.qsize()))]
+        for thread in threads:
+            thread.start()
+        running = len(threads)
+        try:
+            while running:
+                item = results.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+    def run(self) -> dict:
+        jobs, todo = self.plan()
+        files = [path for scenes in self.stream(todo) for path, _ in scenes]
+        return {'total': len(jobs), 'skipped': len(jobs) - len(todo), 'generated': len(files), 'files': sorted(files)}
+
+def generate_scenes(scripts: dict, styles: list = STYLES, scene_brief_map: dict = SCENE_BRIEF_MAP,
+                    output_dir: str = "./data/output-2", concurrency: int = 1, force: bool = False) -> dict:
+    return SceneScheduler(scripts, styles, scene_brief_map, output_dir, concurrency=concurrency, force=force).run()
+
+def rate_scenes(paths: list[str], steps: list) -> list[dict]:
+    # runs pipeline steps (e.g. a FusedClassifyStep) over just these scene files
+    context = {'filenames': paths}
+    for step in steps:
+        context = step.process(context)
+    for row in context.get('results', []):
+        print(f"{os.path.basename(row['filename'])}: {row['task']} -> {row['rating']}")
+    return context.get('results', [])
+
+class SceneWatcher:
+    # Polls the scripts and the style briefs in this file and regenerates the scenes
+    # of what changed. A script is fingerprinted by its content hash (the corpus
+    # rescan only rehashes files whose size or mtime changed), a style by the hash of
+    # its brief; the briefs are reloaded only when this file's mtime changed. The
+    # scheduler then skips every scene whose prompt and settings are unchanged, so an
+    # edited brief costs one generation per script and an edited script one per style.
+
+    def __init__(self, script_dir: str = "./data/scripts", output_dir: str = "./data/output-2",
+                 styles_path: str = __file__, concurrency: int = 1, rate_steps: list | None = None):
+        self.corpus = Corpus(script_dir, "*.txt")
+        self.output_dir = output_dir
+        self.styles_path = styles_path
+        self.concurrency = concurrency
+        self.rate_steps = rate_steps
+        self.styles_mtime = None
+        self.styles: list = []
+        self.scene_brief_map: dict = {}
+        self.fingerprints: dict | None = None
+
+    def reload_styles(self):
+        mtime = os.stat(self.styles_path).st_mtime_ns
+        if mtime != self.styles_mtime:
+            try:
+                self.styles, self.scene_brief_map = load_styles(self.styles_path)
+            except Exception as exc:
+                # a half-saved edit: keep the previous briefs and try again next poll
+                print(f"Could not load the styles from {self.styles_path}: {exc}")
+                return
+            self.styles_mtime = mtime
+
+    def fingerprint(self) -> dict:
+        self.corpus.scan()
+        self.reload_styles()
+        return {
+            **{('script', script_name(path)): self.corpus.content_hash(path) for path in self.corpus.paths()},
+            **{('style', style): text_hash(style + "\n" + self.scene_brief_map.get(style, "")) for style in self.styles}
+        }
+
+    def poll(self) -> dict | None:
+        # None if nothing changed since the last poll, else the scheduler result
+        fingerprints = self.fingerprint()
+        if fingerprints == self.fingerprints:
+            return None
+        if self.fingerprints is not None:
+            changed = sorted(
+                key for key in fingerprints.keys() | self.fingerprints.keys()
+                if fingerprints.get(key) != self.fingerprints.get(key)
             )
-            output = generate_text(prompt)
-            save_script(output, script_name=script_name, style=style)
+            print("Changed: " + ", ".join(f"{kind} {name}" for kind, name in changed))
+        self.fingerprints = fingerprints
+        scripts = {script_name(path): self.corpus.text(path) for path in self.corpus.paths()}
+        result = SceneScheduler(scripts, self.styles, self.scene_brief_map, self.output_dir,
+                                concurrency=self.concurrency).run()
+        if self.rate_steps and result['files']:
+            result['ratings'] = rate_scenes(result['files'], self.rate_steps)
+        return result
+
+    def watch(self, interval: float = 2.0):
+        print(f"Watching {self.corpus.source} and {self.styles_path}, Ctrl+C to stop")
+        try:
+            while True:
+                self.poll()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopped watching")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a scene per script and style")
+    parser.add_argument("--scripts", default="./data/scripts")
+    parser.add_argument("--output", default="./data/output-2")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--watch", action="store_true", help="regenerate changed scripts and briefs until stopped")
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--rate", action="store_true", help="rate regenerated scenes with the Bechdel classifiers")
+    args = parser.parse_args()
+    enable_response_cache()
+    if args.watch:
+        rate_steps = None
+        if args.rate:
+            from bechdelPipeline import LABELS, TASKS, FusedClassifyStep
+            from resultStore import ResultStore
+            rate_steps = [FusedClassifyStep(TASKS, LABELS, seed=0, store=ResultStore("ratings.db"), max_prompt_tokens=4096)]
+        SceneWatcher(args.scripts, args.output, concurrency=args.concurrency, rate_steps=rate_steps).watch(args.interval)
+    else:
+        generate_scenes(load_scripts(args.scripts), output_dir=args.output, concurrency=args.concurrency)
@@ -1,49 +1,105 @@
 # text_generation.py
-import os
-from dotenv import load_dotenv
-from huggingface_hub import login
-import torch
-from transformers import AutoProcessor, Gemma3ForConditionalGeneration
-
-load_dotenv()
-hf_token = os.getenv("HUGGING_FACE")
-if not hf_token:
-    raise ValueError("Please set HUGGING_FACE in your environment")
-
-login(token=hf_token)
-
-_MODEL_ID = "google/gemma-3-4b-it"
-_processor = AutoProcessor.from_pretrained(_MODEL_ID)
-_model = Gemma3ForConditionalGeneration.from_pretrained(
-    _MODEL_ID,
-    device_map="auto",
-    torch_dtype=torch.bfloat16
-).eval()
+from generationCore import generate, normalize_scores, sample, score, stream
+from modelRegistry import MODEL_ID, enable_prefix_cache, set_backend
+from promptTemplate import FilledPrompt
+from responseCache import enable_response_cache
+
+def as_conversation(prompt: str | FilledPrompt) -> list[dict]:
+    # a filled template already is a conversation (and carries its token ids)
+    return prompt if isinstance(prompt, FilledPrompt) else [{"role": "user", "content": prompt}]
+
+def generate_texts(
+    prompts: list[str | FilledPrompt],
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    batch_size: int = 8,
+    seed: int | None = None,
+    stop: list | None = None,
+    model_id: str = MODEL_ID,
+    timings: list | None = None
+) -> list[str]:
+    conversations = [as_conversation(prompt) for prompt in prompts]
+    return generate(
+        conversations,
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        temperature=temperature,
+        batch_size=batch_size,
+        seed=seed,
+        stop=stop,
+        model_id=model_id,
+        timings=timings
+    )
 
 def generate_text(
-    prompt: str,
+    prompt: str | FilledPrompt,
     max_new_tokens: int = 1000,
     do_sample: bool = True,
-    temperature: float = 0.8
+    temperature: float = 0.8,
+    seed: int | None = None,
+    stop: list | None = None
 ) -> str:
-    messages = [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
-    inputs = _processor.apply_chat_template(
-        messages,
-        add_generation_prompt=True,
-        tokenize=True,
-        return_dict=True,
-        return_tensors="pt"
-    ).to(_model.device, dtype=torch.bfloat16)
-
-    input_len = inputs["input_ids"].shape[-1]
-    with torch.inference_mode():
-        outputs = _model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            do_sample=do_sample,
-            temperature=temperature
-        )
-    return _processor.decode(outputs[0][input_len:], skip_special_tokens=True).strip()
+    return generate_texts(
+        [prompt],
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        temperature=temperature,
+        seed=seed,
+        stop=stop
+    )[0]
+
+def sample_texts(
+    prompts: list[str | FilledPrompt],
+    num_samples: int,
+    max_new_tokens: int = 1000,
+    temperature: float = 0.8,
+    batch_size: int = 8,
+    seed: int | None = None,
+    stop: list | None = None,
+    model_id: str = MODEL_ID
+) -> list[list[str]]:
+    conversations = [as_conversation(prompt) for prompt in prompts]
+    return sample(
+        conversations,
+        num_samples,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        batch_size=batch_size,
+        seed=seed,
+        stop=stop,
+        model_id=model_id
+    )
+
+def stream_text(
+    prompt: str | FilledPrompt,
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    seed: int | None = None,
+    stop: list | None = None
+):
+    return stream(
+        as_conversation(prompt),
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        temperature=temperature,
+        seed=seed,
+        stop=stop
+    )
+
+def score_options_batch(
+    prompts: list[str | FilledPrompt],
+    options: list[str],
+    batch_size: int = 8,
+    model_id: str = MODEL_ID
+) -> list[dict[str, float]]:
+    conversations = [as_conversation(prompt) for prompt in prompts]
+    logprobs = score(conversations, options, batch_size=batch_size, model_id=model_id)
+    return [dict(zip(options, normalize_scores(lp))) for lp in logprobs]
+
+def score_options(prompt: str, options: list[str]) -> dict[str, float]:
+    return score_options_batch([prompt], options)[0]
 
 # main 
 if __name__ == "__main__":
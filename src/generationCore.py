@@ -0,0 +1,761 @@
+import copy
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from inferenceClient import generate_remote, score_remote, server_url
+from modelRegistry import MODEL_ID, current_backend, get_model, get_prefix_cache, is_loaded, model_lock
+from responseCache import get_response_cache
+
+# stand-in for the model (generate/sample/score/stream), e.g. mockBackend.MockBackend
+_generation_backend = None
+
+
+def remote_serves(model_id: str) -> bool:
+    # the daemon runs the default model only; other models are loaded here
+    return bool(server_url()) and model_id == MODEL_ID
+
+
+def set_generation_backend(backend=None):
+    global _generation_backend
+    _generation_backend = backend
+
+
+def tokenizer_of(processor):
+    return getattr(processor, "tokenizer", processor)
+
+
+def count_tokens(text: str, model_id: str = MODEL_ID) -> int:
+    # the real tokenizer once the model is loaded, about four characters per token before
+    if _generation_backend is None and is_loaded(model_id):
+        processor, _ = get_model(model_id)
+        return len(tokenizer_of(processor)(text, add_special_tokens=False)["input_ids"])
+    return len(text) // 4 + 1
+
+
+def format_messages(messages: list[dict]) -> list[dict]:
+    formatted = []
+    for msg in messages:
+        content = msg["content"]
+        blocks = (
+            content
+            if isinstance(content, list)
+            else [{"type": "text", "text": content}]
+        )
+        formatted.append({"role": msg["role"], "content": blocks})
+    return formatted
+
+
+def encode_messages(processor, messages: list[dict]) -> list[int]:
+    # a promptTemplate.FilledPrompt splices its pre-tokenised template instead
+    if hasattr(messages, "ids"):
+        return messages.ids(processor)
+    text = processor.apply_chat_template(
+        format_messages(messages),
+        add_generation_prompt=True,
+        tokenize=False
+    )
+    return tokenizer_of(processor)(text, add_special_tokens=False)["input_ids"]
+
+
+def length_buckets(lengths: list[int], batch_size: int) -> list[list[int]]:
+    # similar lengths end up in the same batch, so little compute is spent on padding
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def left_pad(sequences: list[list[int]], pad_id: int):
+    import torch
+
+    width = max(len(seq) for seq in sequences)
+    input_ids = torch.full((len(sequences), width), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+    for row, seq in enumerate(sequences):
+        input_ids[row, width - len(seq):] = torch.tensor(seq, dtype=torch.long)
+        attention_mask[row, width - len(seq):] = 1
+    return input_ids, attention_mask
+
+
+def pad_token_id(processor) -> int:
+    tokenizer = tokenizer_of(processor)
+    return tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+
+def derive_seed(seed: int, sequences: list[list[int]]) -> int:
+    digest = hashlib.sha256(f"{seed}:{sequences}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little")
+
+
+def common_prefix_length(a: list[int], b: list[int]) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def cache_nbytes(cache) -> int:
+    import torch
+
+    layers = getattr(cache, "layers", None)
+    if layers is not None:
+        tensors = [getattr(layer, name, None) for layer in layers for name in ("keys", "values")]
+    else:
+        tensors = list(cache.key_cache) + list(cache.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+
+class PrefixCache:
+    # Keeps past-key-values of token prefixes shared between recent prompts
+    # (e.g. the conversation in front of several criteria), so only the
+    # differing suffix has to be prefilled again.
+    def __init__(self, max_bytes: int = 2 * 1024 ** 3, min_prefix_tokens: int = 64, history: int = 64):
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self.entries: OrderedDict[tuple, tuple] = OrderedDict()
+        self.recent: deque = deque(maxlen=history)
+        self.total_bytes = 0
+        self.hits = 0
+        self.prefilled_tokens = 0
+        self.reused_tokens = 0
+
+    def remember(self, ids: list[int]):
+        self.recent.append(tuple(ids))
+
+    def _longest_entry(self, ids: tuple):
+        best = None
+        for key in self.entries:
+            if len(key) < len(ids) and ids[:len(key)] == key and (best is None or len(key) > len(best)):
+                best = key
+        return best
+
+    def _shared_length(self, ids: tuple) -> int:
+        others = list(self.recent)
+        if ids in others:
+            others.remove(ids)
+        if not others:
+            return 0
+        # the last prompt token must stay uncached so generate has something to prefill
+        return min(max(common_prefix_length(ids, r) for r in others), len(ids) - 1)
+
+    def _put(self, key: tuple, cache):
+        nbytes = cache_nbytes(cache)
+        if nbytes > self.max_bytes:
+            return
+        self.entries[key] = (cache, nbytes)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted
+
+    def find(self, model, ids: list[int]) -> tuple | None:
+        # the key of the longest cached prefix of ids, prefilling a new entry first
+        # when ids share enough of their start with recent prompts
+        import torch
+
+        ids = tuple(ids)
+        key = self._longest_entry(ids)
+        base = len(key) if key else 0
+        target = self._shared_length(ids)
+        if target >= max(base + self.min_prefix_tokens, self.min_prefix_tokens):
+            past = copy.deepcopy(self.entries[key][0]) if key else None
+            with torch.inference_mode():
+                out = model(
+                    input_ids=torch.tensor([ids[base:target]], device=model.device),
+                    past_key_values=past,
+                    use_cache=True
+                )
+            self.prefilled_tokens += target - base
+            key = ids[:target]
+            self._put(key, out.past_key_values)
+        if key is None or key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.reused_tokens += len(key)
+        return key
+
+    def past(self, key: tuple, rows: int = 1):
+        # a copy of the entry's past-key-values, repeated for a batch of rows
+        past = copy.deepcopy(self.entries[key][0])
+        if rows > 1:
+            past.batch_repeat_interleave(rows)
+        return past
+
+    def lookup(self, model, ids: list[int]):
+        key = self.find(model, ids)
+        return None if key is None else self.past(key)
+
+
+def compile_stops(stop) -> list:
+    # plain strings match literally, compiled patterns are used as given
+    return [re.compile(re.escape(pattern)) if isinstance(pattern, str) else pattern for pattern in stop or []]
+
+
+def serialize_stops(stop) -> list:
+    return [[pattern.pattern, pattern.flags] for pattern in compile_stops(stop)]
+
+
+def deserialize_stops(stop: list) -> list:
+    return [re.compile(pattern, flags) for pattern, flags in stop or []]
+
+
+def find_stop(text: str, patterns: list) -> int | None:
+    ends = [m.end() for m in (pattern.search(text) for pattern in patterns) if m]
+    return min(ends) if ends else None
+
+
+def truncate_at_stop(text: str, patterns: list) -> str:
+    end = find_stop(text, patterns)
+    return text if end is None else text[:end]
+
+
+def stopping_criteria(tokenizer, patterns: list, prompt_len: int):
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class PatternStop(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            done = [
+                find_stop(tokenizer.decode(row[prompt_len:], skip_special_tokens=True), patterns) is not None
+                for row in input_ids
+            ]
+            return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    return StoppingCriteriaList([PatternStop()])
+
+
+def first_token_timer():
+    # a streamer for model.generate that notes when the first new tokens arrive: the
+    # first put() carries the prompt, the second one the first generated tokens
+    from transformers.generation.streamers import BaseStreamer
+
+    class FirstTokenTimer(BaseStreamer):
+        def __init__(self):
+            self.start = time.perf_counter()
+            self.puts = 0
+            self.first = None
+
+        def put(self, value):
+            self.puts += 1
+            if self.puts == 2:
+                self.first = time.perf_counter() - self.start
+
+        def end(self):
+            pass
+
+        def timing(self) -> dict:
+            return {'ttft': self.first, 'latency': time.perf_counter() - self.start, 'cached': False}
+
+    return FirstTokenTimer()
+
+
+def _window_covers(model, length: int) -> bool:
+    # a sliding window counts padding as tokens, so padding between a cached prefix
+    # and the suffixes only leaves the attention unchanged while the window spans it all
+    config = model.config.get_text_config() if hasattr(model.config, "get_text_config") else model.config
+    window = getattr(config, "sliding_window", None)
+    return window is None or length <= window
+
+
+def _prefix_batches(model, encoded: list[list[int]], hits: dict[tuple, list[int]], batch_size: int,
+                    max_new_tokens: int) -> list[tuple[list[int], tuple]]:
+    # (indices, prefix key): hits on one prefix entry share its past-key-values; their
+    # suffixes are padded to one length where that is exact, otherwise only suffixes
+    # of the same length go together
+    batches = []
+    for key, indices in hits.items():
+        lengths = [len(encoded[i]) - len(key) for i in indices]
+        if _window_covers(model, len(key) + max(lengths) + max_new_tokens):
+            groups = length_buckets(lengths, batch_size)
+        else:
+            same: dict[int, list[int]] = {}
+            for j, n in enumerate(lengths):
+                same.setdefault(n, []).append(j)
+            groups = [rows[i:i + batch_size] for rows in same.values() for i in range(0, len(rows), batch_size)]
+        batches += [([indices[j] for j in group], key) for group in groups]
+    return batches
+
+
+def generate_batch(
+    processor,
+    model,
+    conversations: list[list[dict]],
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    batch_size: int = 8,
+    prefix_cache: PrefixCache | None = None,
+    seed: int | None = None,
+    stop: list | None = None,
+    timings: list | None = None
+) -> list[str]:
+    # timings, if given, gets one {'ttft', 'latency', 'cached', 'prompt_tokens',
+    # 'output_tokens'} per conversation; rows of one batch share the batch's times,
+    # the token counts are each row's own (chat template included, padding not)
+    import torch
+
+    tokenizer = tokenizer_of(processor)
+    pad_id = pad_token_id(processor)
+    patterns = compile_stops(stop)
+    encoded = [encode_messages(processor, conv) for conv in conversations]
+    results: list[str] = [""] * len(encoded)
+    if timings is not None:
+        timings[:] = [None] * len(encoded)
+    pending = list(range(len(encoded)))
+    hits: dict[tuple, list[int]] = {}
+    if prefix_cache is not None:
+        for ids in encoded:
+            prefix_cache.remember(ids)
+        pending = []
+        for idx, ids in enumerate(encoded):
+            key = prefix_cache.find(model, ids)
+            if key is None:
+                pending.append(idx)
+            else:
+                hits.setdefault(key, []).append(idx)
+    batches = _prefix_batches(model, encoded, hits, batch_size, max_new_tokens)
+    batches += [([pending[i] for i in group], None)
+                for group in length_buckets([len(encoded[i]) for i in pending], batch_size)]
+    for bucket, key in batches:
+        if key is None:
+            past = None
+            input_ids, attention_mask = left_pad([encoded[i] for i in bucket], pad_id)
+        else:
+            # the cached prefix once per row, then the left-padded suffixes
+            past = prefix_cache.past(key, len(bucket))
+            suffix_ids, suffix_mask = left_pad([encoded[i][len(key):] for i in bucket], pad_id)
+            input_ids = torch.cat([torch.tensor([key] * len(bucket), dtype=torch.long), suffix_ids], dim=1)
+            attention_mask = torch.cat([torch.ones((len(bucket), len(key)), dtype=torch.long), suffix_mask], dim=1)
+        input_len = input_ids.shape[-1]
+        if seed is not None:
+            # seeded per bucket: the same prompts and batch size reproduce the same samples
+            torch.manual_seed(derive_seed(seed, [encoded[i] for i in bucket]))
+        timer = first_token_timer() if timings is not None else None
+        with torch.inference_mode():
+            outputs = model.generate(
+                input_ids=input_ids.to(model.device),
+                attention_mask=attention_mask.to(model.device),
+                past_key_values=past,
+                max_new_tokens=max_new_tokens,
+                do_sample=do_sample,
+                temperature=temperature,
+                pad_token_id=pad_id,
+                stopping_criteria=stopping_criteria(tokenizer, patterns, input_len) if patterns else None,
+                streamer=timer
+            )
+        for row, idx in enumerate(bucket):
+            text = tokenizer.decode(outputs[row][input_len:], skip_special_tokens=True)
+            results[idx] = truncate_at_stop(text, patterns).strip()
+            if timer is not None:
+                timings[idx] = {**timer.timing(), 'prompt_tokens': len(encoded[idx]),
+                                'output_tokens': int((outputs[row][input_len:] != pad_id).sum())}
+    return results
+
+
+def sample_batch(
+    processor,
+    model,
+    conversations: list[list[dict]],
+    num_samples: int,
+    max_new_tokens: int = 1000,
+    temperature: float = 0.8,
+    batch_size: int = 8,
+    seed: int | None = None,
+    stop: list | None = None
+) -> list[list[str]]:
+    import torch
+
+    tokenizer = tokenizer_of(processor)
+    pad_id = pad_token_id(processor)
+    patterns = compile_stops(stop)
+    encoded = [encode_messages(processor, conv) for conv in conversations]
+    results: list[list[str]] = [[] for _ in encoded]
+    # batch_size counts generated rows, every prompt expands to num_samples of them
+    for bucket in length_buckets([len(ids) for ids in encoded], max(1, batch_size // num_samples)):
+        input_ids, attention_mask = left_pad([encoded[i] for i in bucket], pad_id)
+        input_len = input_ids.shape[-1]
+        if seed is not None:
+            torch.manual_seed(derive_seed(seed, [encoded[i] for i in bucket]))
+        with torch.inference_mode():
+            outputs = model.generate(
+                input_ids=input_ids.to(model.device),
+                attention_mask=attention_mask.to(model.device),
+                max_new_tokens=max_new_tokens,
+                do_sample=True,
+                temperature=temperature,
+                num_return_sequences=num_samples,
+                pad_token_id=pad_id,
+                stopping_criteria=stopping_criteria(tokenizer, patterns, input_len) if patterns else None
+            )
+        for row, idx in enumerate(bucket):
+            for k in range(num_samples):
+                text = tokenizer.decode(outputs[row * num_samples + k][input_len:], skip_special_tokens=True)
+                results[idx].append(truncate_at_stop(text, patterns).strip())
+    return results
+
+
+def score_batch(
+    processor,
+    model,
+    conversations: list[list[dict]],
+    candidates: list[str],
+    batch_size: int = 8
+) -> list[list[float]]:
+    import torch
+
+    tokenizer = tokenizer_of(processor)
+    pad_id = pad_token_id(processor)
+    candidate_ids = [tokenizer(c, add_special_tokens=False)["input_ids"] for c in candidates]
+    encoded = [encode_messages(processor, conv) for conv in conversations]
+    scores = [[0.0] * len(candidates) for _ in encoded]
+
+    first = [ids[0] for ids in candidate_ids]
+    if len(set(first)) == len(first):
+        # options with distinct first tokens: the next-token distribution after the
+        # prompt tells them apart, the rest of an option is all but certain once begun
+        for bucket in length_buckets([len(ids) for ids in encoded], batch_size):
+            input_ids, attention_mask = left_pad([encoded[i] for i in bucket], pad_id)
+            with torch.inference_mode():
+                logits = model(
+                    input_ids=input_ids.to(model.device),
+                    attention_mask=attention_mask.to(model.device),
+                    logits_to_keep=1
+                ).logits[:, -1, :]
+            logprobs = torch.log_softmax(logits.float(), dim=-1)
+            for row, idx in enumerate(bucket):
+                scores[idx] = logprobs[row, first].tolist()
+        return scores
+
+    rows = [(i, j) for i in range(len(encoded)) for j in range(len(candidate_ids))]
+    sequences = [encoded[i] + candidate_ids[j] for i, j in rows]
+    keep = max(len(ids) for ids in candidate_ids) + 1
+    for bucket in length_buckets([len(seq) for seq in sequences], batch_size):
+        input_ids, attention_mask = left_pad([sequences[k] for k in bucket], pad_id)
+        with torch.inference_mode():
+            logits = model(
+                input_ids=input_ids.to(model.device),
+                attention_mask=attention_mask.to(model.device),
+                logits_to_keep=keep
+            ).logits
+        logprobs = torch.log_softmax(logits.float(), dim=-1).cpu()
+        for row, k in enumerate(bucket):
+            i, j = rows[k]
+            n = len(candidate_ids[j])
+            # logits[t] predicts the token after position width - keep + t
+            predicted = logprobs[row, keep - n - 1:keep - 1]
+            targets = torch.tensor(candidate_ids[j], dtype=torch.long)
+            # the option's log-prob: the sum over its tokens
+            scores[i][j] = predicted.gather(-1, targets.unsqueeze(-1)).sum().item()
+    return scores
+
+
+def normalize_scores(logprobs: list[float]) -> list[float]:
+    top = max(logprobs)
+    weights = [math.exp(lp - top) for lp in logprobs]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def stream_one(
+    processor,
+    model,
+    conversation: list[dict],
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    prefix_cache: PrefixCache | None = None,
+    seed: int | None = None,
+    stop: list | None = None
+):
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+    tokenizer = tokenizer_of(processor)
+    patterns = compile_stops(stop)
+    ids = encode_messages(processor, conversation)
+    past = None
+    if prefix_cache is not None:
+        prefix_cache.remember(ids)
+        past = prefix_cache.lookup(model, ids)
+
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    cancelled = threading.Event()
+    errors: list[BaseException] = []
+
+    class Cancel(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
+    input_ids = torch.tensor([ids], dtype=torch.long, device=model.device)
+
+    def run():
+        try:
+            with torch.inference_mode():
+                model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    past_key_values=past,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=do_sample,
+                    temperature=temperature,
+                    pad_token_id=pad_token_id(processor),
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([Cancel()])
+                )
+        except BaseException as exc:
+            errors.append(exc)
+            streamer.end()
+
+    if seed is not None:
+        torch.manual_seed(derive_seed(seed, [ids]))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    text = ""
+    try:
+        for chunk in streamer:
+            if not text:
+                chunk = chunk.lstrip()
+            end = find_stop(text + chunk, patterns)
+            if end is not None:
+                chunk = (text + chunk)[len(text):end]
+            text += chunk
+            if chunk:
+                yield chunk
+            if end is not None:
+                break
+    finally:
+        # also reached when the consumer stops iterating early
+        cancelled.set()
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _cache_key(cache, conversation, model_id, max_new_tokens, do_sample, temperature, seed, stop) -> str:
+    return cache.make_key(
+        model=model_id,
+        backend=current_backend(),
+        messages=format_messages(conversation),
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        temperature=temperature,
+        seed=seed,
+        stop=serialize_stops(stop)
+    )
+
+
+def generate(
+    conversations: list[list[dict]],
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    batch_size: int = 8,
+    seed: int | None = None,
+    stop: list | None = None,
+    model_id: str = MODEL_ID,
+    timings: list | None = None
+) -> list[str]:
+    # timings, if given, gets one {'ttft', 'latency', 'cached'} per conversation;
+    # ttft and the token counts are only known for the local model
+    cache = get_response_cache()
+    results: list[str | None] = [None] * len(conversations)
+    keys: list[str] = []
+    if cache is not None:
+        keys = [
+            _cache_key(cache, conv, model_id, max_new_tokens, do_sample, temperature, seed, stop)
+            for conv in conversations
+        ]
+        results = [cache.get(key) for key in keys]
+    if timings is not None:
+        timings[:] = [{'ttft': 0.0, 'latency': 0.0, 'cached': True} for _ in conversations]
+    missing = [i for i, text in enumerate(results) if text is None]
+    if not missing:
+        return results
+    pending = [conversations[i] for i in missing]
+    # filled by the local model only
+    pending_timings: list | None = None if timings is None else []
+    start = time.perf_counter()
+    if _generation_backend is not None:
+        texts = _generation_backend.generate(
+            pending,
+            max_new_tokens=max_new_tokens,
+            do_sample=do_sample,
+            temperature=temperature,
+            seed=seed,
+            stop=stop,
+            model_id=model_id
+        )
+    elif remote_serves(model_id):
+        texts = generate_remote(
+            pending,
+            max_new_tokens=max_new_tokens,
+            do_sample=do_sample,
+            temperature=temperature,
+            seed=seed,
+            stop=stop,
+            batch_size=batch_size
+        )
+    else:
+        processor, model = get_model(model_id)
+        with model_lock(model_id):
+            texts = generate_batch(
+                processor, model, pending,
+                max_new_tokens=max_new_tokens,
+                do_sample=do_sample,
+                temperature=temperature,
+                batch_size=batch_size,
+                prefix_cache=get_prefix_cache(model_id),
+                seed=seed,
+                stop=stop,
+                timings=pending_timings
+            )
+    if timings is not None:
+        latency = time.perf_counter() - start
+        for k, i in enumerate(missing):
+            timings[i] = pending_timings[k] if pending_timings else {'ttft': None, 'latency': latency, 'cached': False}
+    for i, text in zip(missing, texts):
+        results[i] = text
+        if cache is not None:
+            cache.put(keys[i], text, model=model_id)
+    return results
+
+
+def stream(
+    conversation: list[dict],
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    seed: int | None = None,
+    stop: list | None = None,
+    model_id: str = MODEL_ID
+):
+    cache = get_response_cache()
+    key = None
+    if cache is not None:
+        key = _cache_key(cache, conversation, model_id, max_new_tokens, do_sample, temperature, seed, stop)
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+    if _generation_backend is not None:
+        chunks = []
+        for chunk in _generation_backend.stream(
+            conversation,
+            max_new_tokens=max_new_tokens,
+            do_sample=do_sample,
+            temperature=temperature,
+            seed=seed,
+            stop=stop,
+            model_id=model_id
+        ):
+            chunks.append(chunk)
+            yield chunk
+    elif remote_serves(model_id):
+        # the daemon answers in one piece
+        text = generate_remote([conversation], max_new_tokens, do_sample, temperature, seed, stop)[0]
+        chunks = [text]
+        yield text
+    else:
+        processor, model = get_model(model_id)
+        chunks = []
+        # held until the stream ends or is closed, like generate() holds it per call
+        with model_lock(model_id):
+            for chunk in stream_one(
+                processor, model, conversation,
+                max_new_tokens=max_new_tokens,
+                do_sample=do_sample,
+                temperature=temperature,
+                prefix_cache=get_prefix_cache(model_id),
+                seed=seed,
+                stop=stop
+            ):
+                chunks.append(chunk)
+                yield chunk
+    # only answers that were read to the end are cached
+    if cache is not None:
+        cache.put(key, "".join(chunks).strip(), model=model_id)
+
+
+def sample(
+    conversations: list[list[dict]],
+    num_samples: int,
+    max_new_tokens: int = 1000,
+    temperature: float = 0.8,
+    batch_size: int = 8,
+    seed: int | None = None,
+    stop: list | None = None,
+    model_id: str = MODEL_ID
+) -> list[list[str]]:
+    # num_samples sampled answers per conversation; different seeds give fresh samples.
+    # Unseeded calls are not cached: a repeated call (e.g. the next voting round)
+    # has to draw new samples, not get the earlier ones back.
+    cache = get_response_cache() if seed is not None else None
+    results: list[list[str] | None] = [None] * len(conversations)
+    keys: list[str] = []
+    if cache is not None:
+        keys = [
+            _cache_key(cache, conv, model_id, max_new_tokens, True, temperature, seed, stop) + f"x{num_samples}"
+            for conv in conversations
+        ]
+        hits = [cache.get(key) for key in keys]
+        results = [None if hit is None else json.loads(hit) for hit in hits]
+    missing = [i for i, texts in enumerate(results) if texts is None]
+    if not missing:
+        return results
+    pending = [conversations[i] for i in missing]
+    if _generation_backend is not None:
+        samples = _generation_backend.sample(
+            pending, num_samples,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            seed=seed,
+            stop=stop,
+            model_id=model_id
+        )
+    elif remote_serves(model_id):
+        # the daemon has no num_return_sequences, so each conversation is sent num_samples times
+        flat = generate_remote(
+            [conv for conv in pending for _ in range(num_samples)],
+            max_new_tokens=max_new_tokens,
+            do_sample=True,
+            temperature=temperature,
+            seed=seed,
+            stop=stop
+        )
+        samples = [flat[i:i + num_samples] for i in range(0, len(flat), num_samples)]
+    else:
+        processor, model = get_model(model_id)
+        with model_lock(model_id):
+            samples = sample_batch(
+                processor, model, pending, num_samples,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                batch_size=batch_size,
+                seed=seed,
+                stop=stop
+            )
+    for i, texts in zip(missing, samples):
+        results[i] = texts
+        if cache is not None:
+            cache.put(keys[i], json.dumps(texts, ensure_ascii=False), model=model_id)
+    return results
+
+
+def score(
+    conversations: list[list[dict]],
+    candidates: list[str],
+    batch_size: int = 8,
+    model_id: str = MODEL_ID
+) -> list[list[float]]:
+    if _generation_backend is not None:
+        return _generation_backend.score(conversations, candidates, model_id=model_id)
+    if remote_serves(model_id):
+        return score_remote(conversations, candidates)
+    processor, model = get_model(model_id)
+    with model_lock(model_id):
+        return score_batch(processor, model, conversations, candidates, batch_size=batch_size)
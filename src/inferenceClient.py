@@ -0,0 +1,77 @@
+import json
+import os
+import urllib.request
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+
+
+def server_url():
+    return os.getenv("INFERENCE_SERVER_URL")
+
+
+def generate_remote(
+    conversations: list[list[dict]],
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    seed: int | None = None,
+    stop: list | None = None,
+    batch_size: int = 8,
+    url: str | None = None
+) -> list[str]:
+    from generationCore import serialize_stops
+
+    payload = {
+        "conversations": conversations,
+        "max_new_tokens": max_new_tokens,
+        "do_sample": do_sample,
+        "temperature": temperature,
+        "seed": seed,
+        "stop": serialize_stops(stop),
+        "batch_size": batch_size,
+    }
+    request = urllib.request.Request(
+        f"{url or server_url() or DEFAULT_URL}/generate",
+        data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())["texts"]
+
+
+def score_remote(
+    conversations: list[list[dict]],
+    candidates: list[str],
+    url: str | None = None
+) -> list[list[float]]:
+    payload = {"conversations": conversations, "candidates": candidates}
+    request = urllib.request.Request(
+        f"{url or server_url() or DEFAULT_URL}/score",
+        data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())["scores"]
+
+
+def generate_texts(
+    prompts: list[str],
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    seed: int | None = None,
+    stop: list | None = None
+) -> list[str]:
+    conversations = [[{"role": "user", "content": prompt}] for prompt in prompts]
+    return generate_remote(conversations, max_new_tokens, do_sample, temperature, seed, stop)
+
+
+def generate_text(
+    prompt: str,
+    max_new_tokens: int = 1000,
+    do_sample: bool = True,
+    temperature: float = 0.8,
+    seed: int | None = None,
+    stop: list | None = None
+) -> str:
+    return generate_texts([prompt], max_new_tokens, do_sample, temperature, seed, stop)[0]
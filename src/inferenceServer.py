@@ -0,0 +1,299 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from generationCore import (
+    deserialize_stops, encode_messages, find_stop, generate_batch, pad_token_id, score_batch, tokenizer_of,
+    truncate_at_stop
+)
+from modelRegistry import MODEL_ID, current_backend, get_model
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class ContinuousBatcher:
+    # Uses the continuous-batching manager of transformers: new requests join the
+    # running batch between decode steps and finished ones leave it. Temperature is
+    # applied per request; greedy requests get a near-zero temperature. Requests
+    # with stop patterns are streamed and cancelled as soon as one matches. The
+    # manager samples from one shared generator, so seeded requests go through
+    # generate_batch instead (see DynamicBatcher.generate), with the manager paused.
+    mode = "continuous"
+    greedy_temperature = 1e-5
+
+    def __init__(self, processor, model):
+        from transformers import GenerationConfig
+        from transformers.generation.configuration_utils import ContinuousBatchingConfig
+
+        self.processor = processor
+        self.waiters: dict[str, tuple] = {}
+        self.lock = threading.Lock()
+        config = GenerationConfig(
+            do_sample=True,
+            temperature=0.8,
+            max_new_tokens=1000,
+            eos_token_id=model.generation_config.eos_token_id,
+            pad_token_id=pad_token_id(processor)
+        )
+        self.manager = model.init_continuous_batching(
+            generation_config=config,
+            continuous_batching_config=ContinuousBatchingConfig(per_request_processors=True)
+        )
+        self.manager.start()
+        threading.Thread(target=self._collect, daemon=True).start()
+        # scoring and seeded sampling use the same weights, one request at a time and
+        # only while the manager is paused between two decode steps (see _direct)
+        self.direct = DynamicBatcher(processor, model)
+
+    @staticmethod
+    def supported(model) -> bool:
+        try:
+            from transformers.generation.configuration_utils import ContinuousBatchingConfig  # noqa: F401
+            from transformers.generation.continuous_batching import ContinuousBatchingManager
+        except ImportError:
+            return False
+        return hasattr(model, "init_continuous_batching") and hasattr(ContinuousBatchingManager, "pause")
+
+    @contextmanager
+    def _direct(self):
+        # the manager finishes its current step and waits, keeping its running requests
+        # and their cache, until the call is done; direct calls take turns on their own
+        # model_lock
+        with self.manager.pause():
+            yield
+
+    def _collect(self):
+        tokenizer = tokenizer_of(self.processor)
+        while self.manager.is_running():
+            result = self.manager.get_result(timeout=0.5)
+            if result is None:
+                continue
+            finished = result.is_finished()
+            text = None
+            if not finished:
+                # a streamed request: done early once a stop pattern matches
+                with self.lock:
+                    waiter = self.waiters.get(result.request_id)
+                if waiter is None:
+                    continue
+                text = tokenizer.decode(result.generated_tokens, skip_special_tokens=True)
+                if find_stop(text, waiter[1]) is None:
+                    continue
+                self.manager.cancel_request(result.request_id)
+            with self.lock:
+                waiter = self.waiters.pop(result.request_id, None)
+            if waiter is None:
+                continue
+            future, patterns = waiter
+            if finished and result.error:
+                future.set_exception(RuntimeError(result.error))
+                continue
+            if text is None:
+                text = tokenizer.decode(result.generated_tokens, skip_special_tokens=True)
+            future.set_result(truncate_at_stop(text, patterns).strip())
+
+    def submit(self, conversation: list[dict], max_new_tokens: int, do_sample: bool,
+               temperature: float, seed, stop: list) -> Future:
+        request_id = uuid.uuid4().hex
+        future: Future = Future()
+        patterns = deserialize_stops(stop)
+        with self.lock:
+            self.waiters[request_id] = (future, patterns)
+        self.manager.add_request(
+            encode_messages(self.processor, conversation),
+            request_id=request_id,
+            max_new_tokens=max_new_tokens,
+            streaming=bool(patterns),
+            temperature=temperature if do_sample else self.greedy_temperature
+        )
+        return future
+
+    def generate(self, conversations: list[list[dict]], max_new_tokens: int, do_sample: bool,
+                 temperature: float, seed, stop: list, batch_size: int) -> list[str]:
+        with self._direct():
+            return self.direct.generate(conversations, max_new_tokens, do_sample, temperature, seed, stop, batch_size)
+
+    def score(self, conversations: list[list[dict]], candidates: list[str]) -> list[list[float]]:
+        with self._direct():
+            return self.direct.score(conversations, candidates)
+
+    def close(self):
+        self.manager.stop(block=True)
+
+
+class DynamicBatcher:
+    # Fallback for transformers versions without continuous batching: requests that
+    # arrive within max_wait seconds and share their settings go into one batch.
+    mode = "dynamic"
+
+    def __init__(self, processor, model, max_batch: int = 16, max_wait: float = 0.05):
+        self.processor = processor
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: queue.Queue = queue.Queue()
+        # generation batches and score requests take turns on the model
+        self.model_lock = threading.Lock()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            pending = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch:
+                try:
+                    pending.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            groups: dict = {}
+            for item in pending:
+                groups.setdefault(item[1], []).append(item)
+            for (max_new_tokens, do_sample, temperature, seed, stop), items in groups.items():
+                try:
+                    with self.model_lock:
+                        texts = generate_batch(
+                            self.processor, self.model, [conversation for conversation, _, _ in items],
+                            max_new_tokens=max_new_tokens,
+                            do_sample=do_sample,
+                            temperature=temperature,
+                            batch_size=self.max_batch,
+                            seed=seed,
+                            stop=deserialize_stops(json.loads(stop))
+                        )
+                except Exception as exc:
+                    for _, _, future in items:
+                        future.set_exception(exc)
+                    continue
+                for (_, _, future), text in zip(items, texts):
+                    future.set_result(text)
+
+    def submit(self, conversation: list[dict], max_new_tokens: int, do_sample: bool,
+               temperature: float, seed, stop: list) -> Future:
+        future: Future = Future()
+        key = (max_new_tokens, do_sample, temperature, seed, json.dumps(stop or []))
+        self.queue.put((conversation, key, future))
+        return future
+
+    def generate(self, conversations: list[list[dict]], max_new_tokens: int, do_sample: bool,
+                 temperature: float, seed, stop: list, batch_size: int) -> list[str]:
+        # one request in one call, bucketed and seeded like a local generate: the
+        # batches of the queue depend on what else arrives, so seeded samples would not repeat
+        with self.model_lock:
+            return generate_batch(
+                self.processor, self.model, conversations,
+                max_new_tokens=max_new_tokens,
+                do_sample=do_sample,
+                temperature=temperature,
+                batch_size=batch_size,
+                seed=seed,
+                stop=deserialize_stops(stop)
+            )
+
+    def score(self, conversations: list[list[dict]], candidates: list[str]) -> list[list[float]]:
+        with self.model_lock:
+            return score_batch(self.processor, self.model, conversations, candidates, batch_size=self.max_batch)
+
+    def close(self):
+        pass
+
+
+def make_handler(batcher, model_id: str):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                self._reply(404, {"error": "not found"})
+                return
+            self._reply(200, {"model": model_id, "backend": current_backend(), "mode": batcher.mode})
+
+        def read_request(self) -> dict:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not isinstance(request, dict) or not isinstance(request["conversations"], list):
+                raise TypeError("expected an object with a list of conversations")
+            if self.path == "/score" and not isinstance(request["candidates"], list):
+                raise TypeError("expected a list of candidates")
+            return request
+
+        def do_POST(self):
+            if self.path not in ("/generate", "/score"):
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                request = self.read_request()
+            except KeyError as exc:
+                self._reply(400, {"error": f"missing field {exc}"})
+                return
+            except (ValueError, TypeError) as exc:
+                # a missing Content-Length raises a TypeError, broken JSON a ValueError
+                self._reply(400, {"error": f"bad request: {exc}"})
+                return
+            if self.path == "/score":
+                try:
+                    self._reply(200, {"scores": batcher.score(request["conversations"], request["candidates"])})
+                except Exception as exc:
+                    self._reply(500, {"error": str(exc)})
+                return
+            try:
+                settings = {
+                    "max_new_tokens": int(request.get("max_new_tokens", 1000)),
+                    "do_sample": bool(request.get("do_sample", True)),
+                    "temperature": float(request.get("temperature", 0.8)),
+                    "seed": None if request.get("seed") is None else int(request["seed"]),
+                    "stop": request.get("stop", [])
+                }
+                batch_size = int(request.get("batch_size", 8))
+            except (ValueError, TypeError) as exc:
+                self._reply(400, {"error": f"bad request: {exc}"})
+                return
+            try:
+                if settings["seed"] is not None and settings["do_sample"]:
+                    texts = batcher.generate(request["conversations"], batch_size=batch_size, **settings)
+                else:
+                    futures = [batcher.submit(conversation, **settings) for conversation in request["conversations"]]
+                    texts = [future.result() for future in futures]
+                self._reply(200, {"texts": texts})
+            except Exception as exc:
+                self._reply(500, {"error": str(exc)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return InferenceHandler
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, model_id: str = MODEL_ID):
+    # the daemon always runs the model itself, never another daemon
+    os.environ.pop("INFERENCE_SERVER_URL", None)
+    processor, model = get_model(model_id)
+    if ContinuousBatcher.supported(model):
+        batcher = ContinuousBatcher(processor, model)
+    else:
+        batcher = DynamicBatcher(processor, model)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, model_id))
+    print(f"Inference server ({batcher.mode} batching) listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == "__main__":
+    serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT)
@@ -0,0 +1,129 @@
+import math
+import random
+import threading
+import time
+from typing import Callable
+
+from generationCore import compile_stops, set_generation_backend, truncate_at_stop
+
+
+class MockBackend:
+    # Local stand-in for the model: canned or templated answers after a simulated
+    # latency, so the orchestration around the model can be measured on its own.
+    # latency is the mean delay per call (one call per batch), token_latency is added
+    # per output token of the longest answer in the call.
+    def __init__(self,
+                 answer: str | list[str] | Callable[[str], str] = "Neutral",
+                 latency: float = 0.0,
+                 token_latency: float = 0.0,
+                 distribution: str = "fixed",
+                 chars_per_token: int = 4,
+                 seed: int = 0):
+        if distribution not in ("fixed", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.answer = answer
+        self.latency = latency
+        self.token_latency = token_latency
+        self.distribution = distribution
+        self.chars_per_token = chars_per_token
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.busy_seconds = 0.0
+        self.prompts_by_model: dict[str, int] = {}
+
+    def tokens(self, text: str) -> int:
+        return max(1, math.ceil(len(text) / self.chars_per_token)) if text else 0
+
+    @staticmethod
+    def prompt_text(conversation: list[dict]) -> str:
+        parts = []
+        for message in conversation:
+            content = message["content"]
+            if isinstance(content, str):
+                parts.append(content)
+            else:
+                parts.extend(block.get("text", "") for block in content)
+        return "\n".join(parts)
+
+    def _answer(self, prompt: str, index: int) -> str:
+        if callable(self.answer):
+            return self.answer(prompt)
+        if isinstance(self.answer, list):
+            return self.answer[index % len(self.answer)]
+        return self.answer
+
+    def _delay(self) -> float:
+        with self._lock:
+            if self.distribution == "exponential":
+                return self._rng.expovariate(1 / self.latency) if self.latency else 0.0
+            if self.distribution == "lognormal":
+                # a spread of about a factor two; mu is shifted so latency is the mean, not the median
+                sigma = 0.7
+                return self._rng.lognormvariate(math.log(self.latency) - sigma ** 2 / 2, sigma) if self.latency else 0.0
+            return self.latency
+
+    def _complete(self, prompts: list[str], max_new_tokens: int, stop, model_id: str | None = None) -> list[str]:
+        patterns = compile_stops(stop)
+        with self._lock:
+            first = self.prompts
+        texts = [
+            truncate_at_stop(self._answer(prompt, first + i), patterns)[:max_new_tokens * self.chars_per_token].strip()
+            for i, prompt in enumerate(prompts)
+        ]
+        output_tokens = [self.tokens(text) for text in texts]
+        delay = self._delay() + self.token_latency * max(output_tokens, default=0)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            self.calls += 1
+            self.prompts += len(prompts)
+            self.prompt_tokens += sum(self.tokens(prompt) for prompt in prompts)
+            self.output_tokens += sum(output_tokens)
+            self.busy_seconds += delay
+            if model_id is not None:
+                self.prompts_by_model[model_id] = self.prompts_by_model.get(model_id, 0) + len(prompts)
+        return texts
+
+    def generate(self, conversations: list[list[dict]], max_new_tokens: int = 1000, do_sample: bool = True,
+                 temperature: float = 0.8, seed: int | None = None, stop: list | None = None,
+                 model_id: str | None = None) -> list[str]:
+        return self._complete([self.prompt_text(conv) for conv in conversations], max_new_tokens, stop, model_id)
+
+    def sample(self, conversations: list[list[dict]], num_samples: int, max_new_tokens: int = 1000,
+               temperature: float = 0.8, seed: int | None = None, stop: list | None = None,
+               model_id: str | None = None) -> list[list[str]]:
+        prompts = [self.prompt_text(conv) for conv in conversations for _ in range(num_samples)]
+        texts = self._complete(prompts, max_new_tokens, stop, model_id)
+        return [texts[i:i + num_samples] for i in range(0, len(texts), num_samples)]
+
+    def stream(self, conversation: list[dict], max_new_tokens: int = 1000, do_sample: bool = True,
+               temperature: float = 0.8, seed: int | None = None, stop: list | None = None,
+               model_id: str | None = None):
+        text = self._complete([self.prompt_text(conversation)], max_new_tokens, stop, model_id)[0]
+        for i, word in enumerate(text.split(" ")):
+            yield word if i == 0 else f" {word}"
+
+    def score(self, conversations: list[list[dict]], candidates: list[str],
+              model_id: str | None = None) -> list[list[float]]:
+        # the first candidate is always the most likely one
+        self._complete([self.prompt_text(conv) for conv in conversations], 1, None, model_id)
+        return [[-float(j + 1) for j in range(len(candidates))] for _ in conversations]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompts": self.prompts,
+                "prompt_tokens": self.prompt_tokens,
+                "output_tokens": self.output_tokens,
+                "busy_seconds": self.busy_seconds,
+                "prompts_by_model": dict(self.prompts_by_model)
+            }
+
+    def install(self) -> "MockBackend":
+        set_generation_backend(self)
+        return self
@@ -0,0 +1,139 @@
+import os
+import threading
+
+MODEL_ID = "google/gemma-3-4b-it"
+BACKENDS = ("bf16", "int8", "int4")
+
+_models: dict = {}
+_model_locks: dict = {}
+_prefix_caches: dict = {}
+_prefix_cache_settings = None
+_lock = threading.RLock()
+_logged_in = False
+_backend = os.getenv("MODEL_BACKEND", "bf16")
+
+
+def _login():
+    global _logged_in
+    if _logged_in:
+        return
+    from dotenv import load_dotenv
+    from huggingface_hub import login
+
+    load_dotenv()
+    hf_token = os.getenv("HUGGING_FACE")
+    if not hf_token:
+        raise ValueError("Please set HUGGING_FACE in your environment")
+    login(token=hf_token)
+    _logged_in = True
+
+
+def set_backend(backend: str):
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (choose from {', '.join(BACKENDS)})")
+    _backend = backend
+
+
+def current_backend() -> str:
+    return _backend
+
+
+def _quantize_int8(model):
+    # dynamic int8 quantization of every Linear layer, one layer at a time: only the
+    # layer being converted is widened to float32, so the model is never held in
+    # float32 as a whole (quantize_dynamic needs it so, plus a copy)
+    import torch
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+    from torch.ao.quantization import default_dynamic_qconfig
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if type(child) is torch.nn.Linear:
+                child.float()
+                child.qconfig = default_dynamic_qconfig
+                setattr(parent, name, DynamicQuantizedLinear.from_float(child))
+    # what stays unquantized (embeddings, norms) runs in float32 as before
+    return model.float()
+
+
+def _load(model_id: str, backend: str):
+    # torch/transformers are only imported once a model is really needed
+    import torch
+    from transformers import AutoConfig, AutoProcessor, Gemma3ForCausalLM, Gemma3ForConditionalGeneration
+
+    processor = AutoProcessor.from_pretrained(model_id)
+    # the 1B Gemma 3 is text-only and has no vision tower
+    if AutoConfig.from_pretrained(model_id).model_type == "gemma3_text":
+        model_class = Gemma3ForCausalLM
+    else:
+        model_class = Gemma3ForConditionalGeneration
+    if backend == "int8":
+        # for CPU-only hosts: loaded in bfloat16 (the checkpoint's own dtype), then
+        # quantized layer by layer
+        model = _quantize_int8(model_class.from_pretrained(
+            model_id,
+            device_map="cpu",
+            torch_dtype=torch.bfloat16
+        ).eval())
+    elif backend == "int4":
+        # 4-bit weight-only (NF4) via bitsandbytes, activations stay in bfloat16
+        from transformers import BitsAndBytesConfig
+
+        model = model_class.from_pretrained(
+            model_id,
+            device_map="auto",
+            quantization_config=BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16
+            )
+        ).eval()
+    else:
+        model = model_class.from_pretrained(
+            model_id,
+            device_map="auto",
+            torch_dtype=torch.bfloat16
+        ).eval()
+    return processor, model
+
+
+def get_model(model_id: str = MODEL_ID, backend: str | None = None):
+    key = (model_id, backend or _backend)
+    if key[1] not in BACKENDS:
+        raise ValueError(f"Unknown backend: {key[1]} (choose from {', '.join(BACKENDS)})")
+    with _lock:
+        if key not in _models:
+            _login()
+            _models[key] = _load(*key)
+        return _models[key]
+
+
+def model_lock(model_id: str = MODEL_ID, backend: str | None = None) -> threading.Lock:
+    # one model call at a time: concurrent pipeline stages would otherwise share
+    # the device and the global torch seed
+    key = (model_id, backend or _backend)
+    with _lock:
+        return _model_locks.setdefault(key, threading.Lock())
+
+
+def is_loaded(model_id: str = MODEL_ID, backend: str | None = None) -> bool:
+    return (model_id, backend or _backend) in _models
+
+
+def enable_prefix_cache(max_bytes: int = 2 * 1024 ** 3, min_prefix_tokens: int = 64):
+    global _prefix_cache_settings
+    with _lock:
+        _prefix_cache_settings = {"max_bytes": max_bytes, "min_prefix_tokens": min_prefix_tokens}
+        _prefix_caches.clear()
+
+
+def get_prefix_cache(model_id: str = MODEL_ID, backend: str | None = None):
+    if _prefix_cache_settings is None:
+        return None
+    key = (model_id, backend or _backend)
+    with _lock:
+        if key not in _prefix_caches:
+            from generationCore import PrefixCache
+            _prefix_caches[key] = PrefixCache(**_prefix_cache_settings)
+        return _prefix_caches[key]
@@ -1,12 +1,18 @@
-from typing import List
+from typing import Iterable, Iterator, List
 from abc import ABC, abstractmethod
+import queue
 import random
+import threading
 from graphviz import Digraph
 
 class PipelineStep(ABC):
     @abstractmethod
     def process(self, s: str) -> str:
         pass
+    def process_stream(self, items: Iterable) -> Iterator:
+        # steps that need to see several items at once override this
+        for item in items:
+            yield self.process(item)
     def __repr__(self) -> str:
         return self.__class__.__name__
 
@@ -53,6 +59,12 @@ class MakeAppender(PipelineStep):
     def __repr__(self) -> str:
         return f"MakeAppender({self.letter})"
 
+_END = object()
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
 class Pipeline(PipelineStep):
     def __init__(self, steps: List[PipelineStep]):
         self.original_steps = steps.copy()
@@ -72,6 +84,54 @@ class Pipeline(PipelineStep):
             print(current)
         return current
 
+    def run_streaming(self, items: Iterable, queue_size: int = 4) -> Iterator:
+        # every step runs in its own thread and hands its output to the next one
+        # through a bounded queue: a slow step makes the faster ones wait instead
+        # of piling up items in memory
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=queue_size) for _ in self.steps]
+
+        def put(q: queue.Queue, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def drain(q: queue.Queue) -> Iterator:
+            while True:
+                try:
+                    item = q.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        return
+                    continue
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+
+        def work(step: PipelineStep, source: Iterable, out: queue.Queue):
+            try:
+                for item in step.process_stream(source):
+                    if stop.is_set():
+                        return
+                    put(out, item)
+            except BaseException as exc:
+                put(out, _Failure(exc))
+            put(out, _END)
+
+        source = iter(items)
+        for step, out in zip(self.steps, queues):
+            threading.Thread(target=work, args=(step, source, out), daemon=True).start()
+            source = drain(out)
+        try:
+            yield from source
+        finally:
+            stop.set()
+
     def train_chain(self, source: str, target: str) -> List[PipelineStep]:
         attempts = 0
         while True:
@@ -114,6 +174,8 @@ class Pipeline(PipelineStep):
 
     def process(self, s: str) -> str:
         return self.run_chained(s)
+    def process_stream(self, items: Iterable) -> Iterator:
+        return self.run_streaming(items)
     def __repr__(self) -> str:
         return " -> ".join([step.__class__.__name__ for step in self.steps])
 
@@ -142,6 +204,10 @@ if __name__ == "__main__":
     print("\n=== Pipeline: verkettet ===")
     pipeline.run_chained(word)
 
+    print("\n=== Pipeline: gestreamt ===")
+    for result in pipeline.run_streaming(["BDR", "Kiwi", "Mango"]):
+        print(result)
+
     print("\n=== Pipeline: trainiert ===")
     pipeline.train_chain(word,target)
     pipeline.run_chained(word)
@@ -0,0 +1,102 @@
+import re
+import string
+import threading
+from collections import OrderedDict
+
+from generationCore import format_messages, tokenizer_of
+
+_SENTINEL = re.compile(r"\x00\d+\x00")
+
+# ids of recent slot values: one conversation is rated against every criterion,
+# so it is tokenised once instead of once per prompt (processors stay loaded in
+# the model registry, so their id() is stable)
+_value_ids: OrderedDict = OrderedDict()
+_value_lock = threading.Lock()
+VALUE_CACHE_SIZE = 256
+
+
+def value_ids(processor, text: str) -> list[int]:
+    key = (id(processor), text)
+    with _value_lock:
+        if key in _value_ids:
+            _value_ids.move_to_end(key)
+            return _value_ids[key]
+    ids = tokenizer_of(processor)(text, add_special_tokens=False)["input_ids"]
+    with _value_lock:
+        _value_ids[key] = ids
+        while len(_value_ids) > VALUE_CACHE_SIZE:
+            _value_ids.popitem(last=False)
+    return ids
+
+
+def literal(text: str) -> str:
+    # static text that may contain braces, for building a template
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class PromptTemplate:
+    # A user prompt with named slots, e.g. "Conversation:\n{conversation}\nRate ...".
+    # The static text around the slots, wrapped in the chat template, is rendered
+    # and tokenised once per tokenizer; a filled prompt then only tokenises its slot
+    # values and splices the ids. At a slot edge the ids can differ from tokenising
+    # the whole text in one go (a merge across the edge), the decoded text does not.
+    def __init__(self, template: str):
+        self.template = template
+        self.fields = [name for _, name, _, _ in string.Formatter().parse(template) if name is not None]
+        if not template.strip() or not self.fields:
+            raise ValueError("A prompt template needs static text and at least one slot")
+        # the chat template trims the message, which would change edge slot values
+        if template.startswith("{") or template.endswith("}"):
+            raise ValueError("Slots must not be at the start or end of a prompt template")
+        self._segments: dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def fill(self, **values) -> "FilledPrompt":
+        return FilledPrompt(self, {name: str(value) for name, value in values.items()})
+
+    def segments(self, processor) -> list[list[int]]:
+        # static ids before, between and after the slots, in slot order
+        with self._lock:
+            cached = self._segments.get(id(processor))
+            # the processor is kept with its ids, so its id() cannot be reused meanwhile
+            if cached is None:
+                text = "".join(
+                    literal_text + ("" if name is None else f"\x00{i}\x00")
+                    for i, (literal_text, name, _, _) in enumerate(string.Formatter().parse(self.template))
+                )
+                rendered = processor.apply_chat_template(
+                    format_messages([{"role": "user", "content": text}]),
+                    add_generation_prompt=True,
+                    tokenize=False
+                )
+                tokenizer = tokenizer_of(processor)
+                cached = (processor, [
+                    tokenizer(part, add_special_tokens=False)["input_ids"] for part in _SENTINEL.split(rendered)
+                ])
+                self._segments[id(processor)] = cached
+            return cached[1]
+
+    def encode(self, processor, values: dict[str, str]) -> list[int]:
+        segments = self.segments(processor)
+        ids = list(segments[0])
+        for name, segment in zip(self.fields, segments[1:]):
+            ids += value_ids(processor, values[name])
+            ids += segment
+        return ids
+
+
+class FilledPrompt(list):
+    # A one-message conversation like any other (for the response cache, the
+    # inference daemon and backend overrides), which the local model path encodes
+    # through its template instead of rendering and tokenising the whole chat.
+    def __init__(self, template: PromptTemplate, values: dict[str, str]):
+        super().__init__([{"role": "user", "content": template.template.format(**values)}])
+        self.template = template
+        self.values = values
+
+    @property
+    def text(self) -> str:
+        return self[0]["content"]
+
+    def ids(self, processor) -> list[int]:
+        return self.template.encode(processor, self.values)
@@ -0,0 +1,216 @@
+import argparse
+import csv
+import os
+import warnings
+
+import numpy as np
+
+LABELS = [
+    "Fully matches",
+    "Largely matches",
+    "Neutral",
+    "Largely not matches",
+    "Does not match"
+]
+
+# below this a task counts as constant: no correlation
+VARIANCE_EPS = 1e-12
+
+# (task, sign, task, sign, meaning): a rating contradicts itself when both tasks
+# lean the given way (value * sign > 0), e.g. ManFocused and NotManFocused both matching
+CONFLICTS = [
+    ("ManFocused", 1, "NotManFocused", 1, "focused on a man and on something else"),
+    ("ManFocused", 1, "ManTopic", -1, "focused on a man that is no topic"),
+    ("IndirectMan", 1, "ManTopic", -1, "indirectly about a man that is no topic"),
+    ("Subject", -1, "Topic", 1, "a man is the subject, yet not dealt with"),
+]
+
+
+class RatingTable:
+    # Ratings as columns: task, script (the rated file) and style as integer codes
+    # into their category arrays, the rating as a value between 1.0 (the first
+    # label or statement applies) and -1.0, NaN where a rating is missing or skipped.
+    def __init__(self, columns: dict[str, np.ndarray], categories: dict[str, np.ndarray]):
+        self.columns = columns
+        self.categories = categories
+
+    def __len__(self) -> int:
+        return len(self.columns["value"])
+
+    @staticmethod
+    def _encode(values: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        categories, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        return codes.astype(np.int32), categories
+
+    @classmethod
+    def from_records(cls, tasks: list[str], scripts: list[str], styles: list[str],
+                     values: list[float]) -> "RatingTable":
+        columns, categories = {}, {}
+        for name, raw in (("task", tasks), ("script", scripts), ("style", styles)):
+            columns[name], categories[name] = cls._encode(raw)
+        columns["value"] = np.asarray(values, dtype=np.float64)
+        return cls(columns, categories)
+
+    @classmethod
+    def from_csv(cls, path: str, labels: list[str] = LABELS) -> "RatingTable":
+        # the CSV of WriteCsvStep (Task, Script, Style, Rating, [Score]) or of
+        # SimpleBechdelPipeline (Script, Number, Style, Test, Score, [Skipped])
+        label_values = {
+            label: 1.0 - 2.0 * i / (len(labels) - 1) if len(labels) > 1 else 1.0
+            for i, label in enumerate(labels)
+        }
+        tasks, scripts, styles, values = [], [], [], []
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            col = {name: i for i, name in enumerate(header)}
+            choices = "Test" in col
+            task_col = col["Test" if choices else "Task"]
+            score_col = col.get("Score")
+            for row in reader:
+                tasks.append(row[task_col])
+                script = row[col["Script"]]
+                scripts.append(script + row[col["Number"]] if choices else script)
+                styles.append(row[col["Style"]])
+                score = row[score_col] if score_col is not None else ''
+                if score not in ('', 'None'):
+                    values.append(float(score))
+                elif not choices:
+                    values.append(label_values.get(row[col["Rating"]], np.nan))
+                else:
+                    values.append(np.nan)
+        return cls.from_records(tasks, scripts, styles, values)
+
+    def save_npz(self, path: str):
+        np.savez_compressed(
+            path,
+            **{f"col_{name}": values for name, values in self.columns.items()},
+            **{f"cat_{name}": values for name, values in self.categories.items()}
+        )
+        print(f"Spalten geschrieben: {path}")
+
+    @classmethod
+    def load_npz(cls, path: str) -> "RatingTable":
+        with np.load(path) as data:
+            columns = {key[4:]: data[key] for key in data.files if key.startswith("col_")}
+            categories = {key[4:]: data[key] for key in data.files if key.startswith("cat_")}
+        return cls(columns, categories)
+
+    def group_stats(self, *by: str) -> list[dict]:
+        # count, mean, std, min and max of the value per group, missing values left out
+        shape = tuple(len(self.categories[name]) for name in by)
+        group = np.ravel_multi_index([self.columns[name] for name in by], shape)
+        value = self.columns["value"]
+        ok = ~np.isnan(value)
+        group, value = group[ok], value[ok]
+        size = int(np.prod(shape))
+        count = np.bincount(group, minlength=size)
+        total = np.bincount(group, weights=value, minlength=size)
+        lowest = np.full(size, np.inf)
+        highest = np.full(size, -np.inf)
+        np.minimum.at(lowest, group, value)
+        np.maximum.at(highest, group, value)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            # two passes: squares of the deviations, not sum of squares minus squared mean
+            deviation = value - mean[group]
+            variance = np.bincount(group, weights=deviation * deviation, minlength=size) / count
+            std = np.sqrt(np.where(variance < VARIANCE_EPS, 0.0, variance))
+        stats = []
+        for flat in np.flatnonzero(count):
+            key = np.unravel_index(flat, shape)
+            stats.append({
+                **{name: str(self.categories[name][k]) for name, k in zip(by, key)},
+                "count": int(count[flat]),
+                "mean": float(mean[flat]),
+                "std": float(std[flat]),
+                "min": float(lowest[flat]),
+                "max": float(highest[flat])
+            })
+        return stats
+
+    def pivot(self) -> tuple[np.ndarray, np.ndarray]:
+        # files x tasks matrix of values (NaN where missing) and the task names;
+        # a file is a script in one style
+        files = self.columns["script"].astype(np.int64) * len(self.categories["style"]) + self.columns["style"]
+        keys, rows = np.unique(files, return_inverse=True)
+        matrix = np.full((len(keys), len(self.categories["task"])), np.nan)
+        matrix[rows, self.columns["task"]] = self.columns["value"]
+        return matrix, self.categories["task"]
+
+    def correlation(self) -> tuple[np.ndarray, np.ndarray]:
+        # Pearson correlation between tasks over the files rated for both (pairwise complete)
+        matrix, tasks = self.pivot()
+        present = (~np.isnan(matrix)).astype(np.float64)
+        # centred per task first, so the sums below do not cancel out (a constant task
+        # is all zeros and gets no correlation)
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            centre = np.nanmean(matrix, axis=0)
+        x = np.where(present > 0, matrix - centre, 0.0)
+        n = present.T @ present
+        sum_x = x.T @ present
+        sum_xx = (x * x).T @ present
+        sum_xy = x.T @ x
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov = sum_xy / n - (sum_x / n) * (sum_x.T / n)
+            var_x = sum_xx / n - (sum_x / n) ** 2
+            corr = cov / np.sqrt(var_x * var_x.T)
+        corr[(n < 2) | (var_x < VARIANCE_EPS) | (var_x.T < VARIANCE_EPS)] = np.nan
+        return corr, tasks
+
+    def conflicts(self, checks: list[tuple] = CONFLICTS) -> list[dict]:
+        # files whose ratings contradict each other, per check with both tasks present
+        matrix, tasks = self.pivot()
+        index = {str(task): i for i, task in enumerate(tasks)}
+        results = []
+        for task_a, sign_a, task_b, sign_b, meaning in checks:
+            if task_a not in index or task_b not in index:
+                continue
+            a, b = matrix[:, index[task_a]], matrix[:, index[task_b]]
+            rated = ~np.isnan(a) & ~np.isnan(b)
+            hits = rated & (a * sign_a > 0) & (b * sign_b > 0)
+            results.append({
+                "tasks": (task_a, task_b),
+                "meaning": meaning,
+                "rated": int(rated.sum()),
+                "conflicts": int(hits.sum()),
+                "rate": float(hits.sum() / rated.sum()) if rated.any() else 0.0
+            })
+        return results
+
+    def report(self) -> str:
+        lines = [f"{len(self)} ratings, {int(np.isnan(self.columns['value']).sum())} without value"]
+        for by in (("task",), ("style",), ("task", "style")):
+            lines.append(f"\nMean per {' and '.join(by)}:")
+            for stats in self.group_stats(*by):
+                name = " / ".join(stats[key] for key in by)
+                lines.append(f"  {name:<40} n={stats['count']:<7} mean={stats['mean']:+.3f} std={stats['std']:.3f}")
+        corr, tasks = self.correlation()
+        if len(tasks) > 1:
+            lines.append("\nCorrelation between tasks:")
+            width = max(len(str(task)) for task in tasks)
+            for i, task in enumerate(tasks):
+                cells = " ".join("   -  " if np.isnan(r) else f"{r:+.2f} " for r in corr[i])
+                lines.append(f"  {str(task):<{width}} {cells}")
+        conflicts = self.conflicts()
+        if conflicts:
+            lines.append("\nConsistency:")
+            for check in conflicts:
+                lines.append(f"  {check['tasks'][0]} vs {check['tasks'][1]} ({check['meaning']}): "
+                             f"{check['conflicts']} of {check['rated']} ({check['rate']:.1%})")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Statistics over the rating CSVs")
+    parser.add_argument("source", help="rating CSV or .npz written by this tool")
+    parser.add_argument("--npz", action="store_true", help="write the columns next to the CSV")
+    args = parser.parse_args()
+    if args.source.endswith(".npz"):
+        table = RatingTable.load_npz(args.source)
+    else:
+        table = RatingTable.from_csv(args.source)
+        if args.npz:
+            table.save_npz(os.path.splitext(args.source)[0] + ".npz")
+    print(table.report())
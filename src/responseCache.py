@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_CACHE_DIR = ".cache/responses"
+
+
+class ResponseCache:
+    # Content-addressed answers on disk: one JSON file per key, the file mtime
+    # serves as "last used" so the oldest entries are evicted first.
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = 512 * 1024 ** 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = json.load(f)["text"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str, **meta):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"text": text, **meta}, ensure_ascii=False).encode("utf-8")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            self.total_bytes += len(data) - old_size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = int(self.max_bytes * 0.9)
+        for path, _, size in sorted(self._entries(), key=lambda e: e[1]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+
+
+_response_cache = None
+
+
+def enable_response_cache(directory: str = DEFAULT_CACHE_DIR, max_bytes: int = 512 * 1024 ** 2) -> ResponseCache:
+    global _response_cache
+    _response_cache = ResponseCache(directory, max_bytes)
+    return _response_cache
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None and os.getenv("RESPONSE_CACHE_DIR"):
+        _response_cache = ResponseCache(os.environ["RESPONSE_CACHE_DIR"])
+    return _response_cache
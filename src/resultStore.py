@@ -0,0 +1,128 @@
+import csv
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB = "ratings.db"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_key() -> str:
+    from modelRegistry import MODEL_ID, current_backend
+    return f"{MODEL_ID}:{current_backend()}"
+
+
+class ResultStore:
+    # One row per rating, keyed by everything that influences it: task, criterion
+    # text, file content, model and generation parameters. Each rating is written as
+    # soon as it is done, so an interrupted run resumes where it stopped and a
+    # changed file only invalidates its own rows.
+    def __init__(self, path: str = DEFAULT_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ratings (
+                task TEXT NOT NULL,
+                criterion_hash TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                params TEXT NOT NULL,
+                criterion TEXT,
+                filename TEXT,
+                rating TEXT,
+                score REAL,
+                distribution TEXT,
+                updated REAL,
+                samples INTEGER,
+                PRIMARY KEY (task, criterion_hash, content_hash, model, params)
+            )
+        """)
+        columns = [col[1] for col in self._conn.execute("PRAGMA table_info(ratings)")]
+        if "samples" not in columns:
+            self._conn.execute("ALTER TABLE ratings ADD COLUMN samples INTEGER")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(task: str, criterion: str, content: str, model: str, params: dict) -> tuple:
+        return task, text_hash(criterion), text_hash(content), model, json.dumps(params, sort_keys=True)
+
+    def get(self, task: str, criterion: str, content: str, model: str, params: dict) -> dict | None:
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT rating, score, distribution, samples FROM ratings "
+                "WHERE task=? AND criterion_hash=? AND content_hash=? AND model=? AND params=?",
+                self._key(task, criterion, content, model, params)
+            ).fetchone()
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        rating, score, distribution, samples = found
+        row = {'task': task, 'criterion': criterion, 'rating': rating}
+        if score is not None:
+            row['score'] = score
+        if distribution is not None:
+            row['distribution'] = json.loads(distribution)
+        if samples is not None:
+            row['samples'] = samples
+        return row
+
+    def put(self, task: str, criterion: str, content: str, model: str, params: dict,
+            filename: str, rating: str, score: float | None = None, distribution: dict | None = None,
+            samples: int | None = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ratings (task, criterion_hash, content_hash, model, params, criterion, filename, "
+                "rating, score, distribution, updated, samples) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (task, criterion_hash, content_hash, model, params) DO UPDATE SET "
+                "criterion=excluded.criterion, filename=excluded.filename, rating=excluded.rating, "
+                "score=excluded.score, distribution=excluded.distribution, updated=excluded.updated, "
+                "samples=excluded.samples",
+                (*self._key(task, criterion, content, model, params), criterion, filename, rating, score,
+                 None if distribution is None else json.dumps(distribution), time.time(), samples)
+            )
+            self._conn.commit()
+
+    def rows(self, model: str | None = None) -> list[dict]:
+        # latest rating per (task, filename): older rows of since-changed files are left out
+        query = (
+            "SELECT task, criterion, filename, rating, score, samples, model, params FROM ratings r "
+            "WHERE updated = (SELECT MAX(updated) FROM ratings "
+            "WHERE task = r.task AND filename = r.filename{0}){0} ORDER BY task, filename"
+        ).format("" if model is None else " AND model = :model")
+        with self._lock:
+            cursor = self._conn.execute(query, {"model": model})
+            names = [col[0] for col in cursor.description]
+            return [dict(zip(names, values)) for values in cursor.fetchall()]
+
+    def export_csv(self, out_file: str, model: str | None = None):
+        rows = self.rows(model)
+        with open(out_file, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Task', 'Criterion', 'File', 'Rating', 'Score', 'Samples', 'Model', 'Params'])
+            for row in rows:
+                writer.writerow([row['task'], row['criterion'], row['filename'], row['rating'],
+                                 '' if row['score'] is None else row['score'],
+                                 '' if row['samples'] is None else row['samples'], row['model'], row['params']])
+        print(f"CSV geschrieben: {out_file}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = ResultStore(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DB)
+    store.export_csv(sys.argv[2] if len(sys.argv) > 2 else "ratings_export.csv")
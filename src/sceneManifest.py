@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST = ".scenes.jsonl"
+
+_lock = threading.Lock()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def manifest_path(output_dir: str) -> str:
+    return os.path.join(output_dir, MANIFEST)
+
+
+def append_record(path: str, record: dict):
+    # one write() per line on an O_APPEND file: writers never interleave within a
+    # line, and a crash leaves at most a torn last line (skipped on reading)
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    with _lock:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+def read_manifest(path: str) -> list[dict]:
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def latest(records: list[dict]) -> dict[str, dict]:
+    # filename -> newest record
+    return {record['file']: record for record in records}
+
+
+def _mean(values: list) -> float | None:
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _exact(group: list[dict], key: str) -> list:
+    # token counts measured by the model; estimated ones would skew the mean
+    return [r.get(key) for r in group if not r.get('estimated')]
+
+
+def summarize(records: list[dict], by: str = "style") -> list[dict]:
+    # generated (not cached) scenes grouped by style or script, slowest first
+    groups: dict[str, list[dict]] = {}
+    for record in records:
+        if not record.get('cached'):
+            groups.setdefault(record[by], []).append(record)
+    rows = [
+        {
+            by: name,
+            'scenes': len(group),
+            'latency': _mean([r.get('latency') for r in group]),
+            'ttft': _mean([r.get('ttft') for r in group]),
+            'prompt_tokens': _mean(_exact(group, 'prompt_tokens')),
+            'output_tokens': _mean(_exact(group, 'output_tokens')),
+            'seconds': sum(r.get('latency') or 0.0 for r in group)
+        }
+        for name, group in groups.items()
+    ]
+    return sorted(rows, key=lambda row: row['latency'] or 0.0, reverse=True)
+
+
+def _fmt(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def report(records: list[dict], top: int = 10) -> str:
+    current = list(latest(records).values())
+    generated = [r for r in current if not r.get('cached')]
+    lines = [f"{len(current)} scenes, {len(generated)} generated, {len(current) - len(generated)} from the cache"]
+    lines.append(f"\nSlowest {min(top, len(generated))}:")
+    for r in sorted(generated, key=lambda r: r.get('latency') or 0.0, reverse=True)[:top]:
+        lines.append(f"  {r['script']:<20} {r['style']:<26} {_fmt(r.get('latency'), '.2f')} s, "
+                     f"ttft {_fmt(r.get('ttft'), '.2f')} s, batch of {r.get('batch', 1)}")
+    # estimated counts (len/4, marked ~) are only ranked when nothing was measured
+    measured = [r for r in current if not r.get('estimated')]
+    ranked, mark = (measured, "") if measured else (current, "~")
+    skipped = len(current) - len(ranked)
+    lines.append(f"\nLargest {min(top, len(ranked))}" + (f" ({skipped} estimated left out):" if skipped else ":"))
+    for r in sorted(ranked, key=lambda r: r.get('output_tokens') or 0, reverse=True)[:top]:
+        lines.append(f"  {r['script']:<20} {r['style']:<26} {mark}{r.get('output_tokens')} output tokens, "
+                     f"{mark}{r.get('prompt_tokens')} prompt tokens")
+    for by in ("style", "script"):
+        lines.append(f"\nPer {by} (mean):")
+        for row in summarize(current, by):
+            lines.append(f"  {row[by]:<26} n={row['scenes']:<4} latency {_fmt(row['latency'], '.2f')} s, "
+                         f"ttft {_fmt(row['ttft'], '.2f')} s, {_fmt(row['output_tokens'], '.0f')} output tokens, "
+                         f"{row['seconds']:.1f} s total")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Timings and sizes from the scene generation manifest")
+    parser.add_argument("output_dir", nargs="?", default="./data/output-2")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="per-style and per-script summary as JSON")
+    args = parser.parse_args()
+    records = read_manifest(manifest_path(args.output_dir))
+    if args.json:
+        current = list(latest(records).values())
+        print(json.dumps({by: summarize(current, by) for by in ("style", "script")}, indent=2))
+    else:
+        print(report(records, args.top))
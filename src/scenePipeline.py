@@ -0,0 +1,74 @@
+import argparse
+import os
+import time
+
+from bechdelPipeline import LABELS, TASKS, ExtractScriptStyleStep, FusedClassifyStep, WriteCsvStep, read_conversations
+from filmSzene import SceneScheduler, load_scripts
+from generateText import enable_prefix_cache, enable_response_cache
+from pipeline9 import Pipeline, PipelineStep
+from resultStore import ResultStore
+
+
+class GenerateScenesStep(PipelineStep):
+    # Generates the scenes of a SceneScheduler and hands every saved group on as a
+    # context with the files and their texts, so the rating steps behind it start on
+    # the first script while the next ones are generated. Both share the loaded model
+    # (one model_lock), their calls take turns. Scenes already up to date follow in
+    # chunks after the new ones, so the ratings cover the whole grid.
+    def __init__(self, scheduler: SceneScheduler, include_existing: bool = True, chunk_size: int = 8):
+        self.scheduler = scheduler
+        self.include_existing = include_existing
+        self.chunk_size = chunk_size
+
+    def contexts(self, context: dict):
+        jobs, todo = self.scheduler.plan()
+        for scenes in self.scheduler.stream(todo):
+            yield {
+                **context,
+                'filenames': [path for path, _ in scenes],
+                'conversations': [text.strip() for _, text in scenes]
+            }
+        if self.include_existing:
+            fresh = {job.filename for job in todo}
+            existing = [
+                os.path.join(self.scheduler.output_dir, job.filename)
+                for job in jobs if job.filename not in fresh
+            ]
+            for start in range(0, len(existing), self.chunk_size):
+                yield {**context, 'filenames': existing[start:start + self.chunk_size]}
+
+    def process(self, context: dict) -> dict:
+        filenames, conversations = [], []
+        for chunk in self.contexts(context):
+            filenames += chunk['filenames']
+            conversations += chunk.get('conversations') or read_conversations(chunk['filenames'])
+        return {**context, 'filenames': filenames, 'conversations': conversations}
+
+    def process_stream(self, items):
+        for context in items:
+            yield from self.contexts(context)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the scenes and rate each one as soon as it is saved")
+    parser.add_argument("--scripts", default="./data/scripts")
+    parser.add_argument("--output", default="./data/output-2")
+    parser.add_argument("--csv", default="scene_ratings.csv")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=2, help="generated groups waiting for the raters")
+    args = parser.parse_args()
+    enable_prefix_cache()
+    enable_response_cache()
+
+    scheduler = SceneScheduler(load_scripts(args.scripts), output_dir=args.output, concurrency=args.concurrency)
+    pipeline = Pipeline([
+        GenerateScenesStep(scheduler),
+        FusedClassifyStep(TASKS, LABELS, seed=0, store=ResultStore("ratings.db"), max_prompt_tokens=4096),
+        ExtractScriptStyleStep(),
+        WriteCsvStep(args.csv)
+    ])
+    start = time.perf_counter()
+    rated = 0
+    for context in pipeline.run_streaming([{}], queue_size=args.queue_size):
+        rated += len(context['filenames'])
+        print(f"{rated} scenes rated after {time.perf_counter() - start:.0f} s")
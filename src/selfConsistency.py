@@ -0,0 +1,73 @@
+import math
+from collections import Counter
+from typing import Callable
+
+from generateText import sample_texts
+from modelRegistry import MODEL_ID
+
+
+def binomial_tail(k: int, n: int) -> float:
+    # P(X >= k) for X ~ Binomial(n, 1/2)
+    return sum(math.comb(n, i) for i in range(k, n + 1)) / 2 ** n
+
+
+def is_settled(votes: Counter, alpha: float) -> bool:
+    # the leader beats the runner-up significantly more often than a coin flip would
+    if not votes:
+        return False
+    ranked = votes.most_common(2)
+    leader = ranked[0][1]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    return binomial_tail(leader, leader + runner_up) < alpha
+
+
+def vote(
+    prompts: list[str],
+    parse: Callable[[str], str | None],
+    samples_per_round: int = 4,
+    max_samples: int = 16,
+    alpha: float = 0.05,
+    max_new_tokens: int = 1000,
+    temperature: float = 0.8,
+    batch_size: int = 8,
+    seed: int | None = None,
+    stop: list | None = None,
+    model_id: str = MODEL_ID
+) -> list[dict]:
+    # Draws samples_per_round answers per prompt and round until the leading label
+    # is settled or max_samples is used up. The significance level is split over
+    # all rounds (Bonferroni) since the test is repeated after every round.
+    rounds = math.ceil(max_samples / samples_per_round)
+    alpha_per_round = alpha / rounds
+    votes = [Counter() for _ in prompts]
+    drawn = [0] * len(prompts)
+    active = list(range(len(prompts)))
+    for round_idx in range(rounds):
+        if not active:
+            break
+        n = min(samples_per_round, max_samples - round_idx * samples_per_round)
+        samples = sample_texts(
+            [prompts[i] for i in active],
+            n,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            batch_size=batch_size,
+            seed=None if seed is None else seed + round_idx,
+            stop=stop,
+            model_id=model_id
+        )
+        for i, texts in zip(active, samples):
+            # answers parse() cannot read cost a sample but give no vote
+            votes[i].update(label for label in map(parse, texts) if label is not None)
+            drawn[i] += len(texts)
+        active = [i for i in active if not is_settled(votes[i], alpha_per_round)]
+
+    results = []
+    for counts, samples in zip(votes, drawn):
+        total = sum(counts.values())
+        results.append({
+            'label': counts.most_common(1)[0][0] if counts else None,
+            'distribution': {label: count / total for label, count in counts.most_common()},
+            'samples': samples
+        })
+    return results
@@ -0,0 +1,23 @@
+import json
+import re
+
+# stop generating as soon as the first JSON object is closed
+JSON_OBJECT_STOP = re.compile(r'\{[^{}]*\}')
+
+
+def extract_json_object(text: str) -> dict | None:
+    match = JSON_OBJECT_STOP.search(text)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def match_option(value, options: list[str]) -> str | None:
+    if not isinstance(value, str):
+        return None
+    value = value.strip().strip('.)').lower()
+    return next((opt for opt in options if opt.lower() == value), None)
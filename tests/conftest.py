@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import responseCache
+from generationCore import set_generation_backend
+
+
+@pytest.fixture
+def response_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(responseCache, "_response_cache", None)
+    return responseCache.enable_response_cache(str(tmp_path / "responses"))
+
+
+@pytest.fixture(autouse=True)
+def no_backend():
+    yield
+    set_generation_backend(None)
@@ -0,0 +1,23 @@
+from bechdelPipeline import LABELS, ClassifyStep
+from cascade import Cascade
+from mockBackend import MockBackend
+
+
+def test_unreadable_vote_samples_do_not_settle():
+    MockBackend(answer="I am not sure...").install()
+    cascade = Cascade(threshold=0.8)
+    step = ClassifyStep("ManTopic", "The conversation includes a man as a topic.", LABELS,
+                        seed=0, mode="vote", samples_per_round=4, max_samples=16, cascade=cascade)
+    row = step.rate(["a.txt"], ["A: Hi.\nB: Hello."])[0]
+    assert row['samples'] == 16
+    assert row['distribution'] == {}
+    assert row['rating'] == "Neutral"
+    assert cascade.report()["ManTopic"]['escalated'] == 1
+
+
+def test_readable_vote_samples_still_settle():
+    MockBackend(answer="Does not match").install()
+    step = ClassifyStep("ManTopic", "The conversation includes a man as a topic.", LABELS, seed=0, mode="vote")
+    row = step.rate(["a.txt"], ["A: Hi.\nB: Hello."])[0]
+    assert row['rating'] == "Does not match"
+    assert row['samples'] < 16
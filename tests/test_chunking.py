@@ -0,0 +1,30 @@
+from chunking import chunk_text, split_units
+
+
+def words(text):
+    # additive: a chunk counts exactly its units plus one per separator
+    return len(text.split()) + text.count("\n\n")
+
+
+SCRIPT = "\n".join(
+    f"[SCENE START] **INT. APARTMENT {scene} - DAY**\n"
+    + "\n".join(f"{name}: " + "word " * 6 for name in ("ANNA", "BEA", "CARL"))
+    for scene in range(6)
+)
+
+
+def test_scene_heading_stays_with_the_next_turn():
+    units = split_units("[SCENE START]\n**INT. APARTMENT - DAY**\nANNA: Hi.\nBEA: Hello.")
+    assert units == [("[SCENE START]\n**INT. APARTMENT - DAY**\nANNA: Hi.", True), ("BEA: Hello.", False)]
+
+
+def test_chunks_keep_the_budget_with_separators():
+    # from 20 up a heading fits together with its first turn
+    for max_tokens in (20, 30, 50):
+        chunks = chunk_text(SCRIPT, max_tokens, count=words)
+        assert all(words(chunk) <= max_tokens for chunk in chunks)
+        assert not any(heading_only(chunk) for chunk in chunks)
+
+
+def heading_only(chunk):
+    return all(line.startswith("[SCENE") for line in chunk.splitlines() if line.strip())
@@ -0,0 +1,12 @@
+from filmSzene import SCENE_END, SCENE_START, save_script, strip_scene_markers
+
+
+def test_saved_scene_has_no_markers(tmp_path):
+    output = f"Sure, here it is.\n{SCENE_START}\n**INT. KITCHEN - DAY**\nANNA: Hi.\n{SCENE_END}"
+    path = save_script(output, "Script", "Film noir", output_dir=str(tmp_path))
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "**INT. KITCHEN - DAY**\nANNA: Hi."
+
+
+def test_text_without_markers_stays():
+    assert strip_scene_markers("  ANNA: Hi.\n") == "ANNA: Hi."
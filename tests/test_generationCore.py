@@ -0,0 +1,73 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from generationCore import _prefix_batches, score_batch
+
+torch = pytest.importorskip("torch")
+
+VOCAB = 128
+
+
+class CharProcessor:
+    # one token per character; the chat template is just the message text
+    pad_token_id = 0
+    eos_token_id = 0
+
+    def __call__(self, text, add_special_tokens=False):
+        return {"input_ids": [ord(c) % VOCAB for c in text]}
+
+    def apply_chat_template(self, messages, add_generation_prompt=True, tokenize=False):
+        return "".join(block["text"] for message in messages for block in message["content"])
+
+
+class FixedModel:
+    # the same next-token distribution at every position
+    device = "cpu"
+
+    def __init__(self, logprobs: dict[str, float]):
+        rest = math.log((1.0 - sum(math.exp(lp) for lp in logprobs.values())) / (VOCAB - len(logprobs)))
+        self.logits = torch.full((VOCAB,), rest)
+        for char, lp in logprobs.items():
+            self.logits[ord(char)] = lp
+
+    def __call__(self, input_ids, attention_mask, logits_to_keep):
+        class Output:
+            logits = self.logits.expand(input_ids.shape[0], logits_to_keep, VOCAB).clone()
+        return Output()
+
+
+def test_distinct_first_tokens_score_by_the_first_token():
+    model = FixedModel({"x": -1.0, "y": -1.5})
+    conversations = [[{"role": "user", "content": "Pick one"}]]
+    scores = score_batch(CharProcessor(), model, conversations, ["xxxx", "yy"])[0]
+    assert scores == pytest.approx([-1.0, -1.5], abs=1e-5)
+
+
+def test_shared_first_token_scores_the_whole_option():
+    # a likelier first token does not make up for the longer option: its
+    # log-prob is the sum over all its tokens, not their mean
+    model = FixedModel({"x": -0.5, "y": -1.6, "z": -2.5})
+    conversations = [[{"role": "user", "content": "Pick one"}]]
+    scores = score_batch(CharProcessor(), model, conversations, ["xz", "xyyy"])[0]
+    assert scores == pytest.approx([-3.0, -5.3], abs=1e-5)
+    assert scores[0] > scores[1]
+
+
+def windowed(sliding_window):
+    return SimpleNamespace(config=SimpleNamespace(sliding_window=sliding_window))
+
+
+def test_prefix_hits_share_one_batch():
+    key = tuple(range(10))
+    encoded = [list(key) + [1] * n for n in (2, 3, 5)]
+    batches = _prefix_batches(windowed(None), encoded, {key: [0, 1, 2]}, batch_size=8, max_new_tokens=4)
+    assert batches == [([0, 1, 2], key)]
+
+
+def test_prefix_hits_beyond_the_window_pad_nothing():
+    key = tuple(range(10))
+    encoded = [list(key) + [1] * n for n in (2, 3, 2)]
+    batches = _prefix_batches(windowed(8), encoded, {key: [0, 1, 2]}, batch_size=8, max_new_tokens=4)
+    assert sorted(batches) == [([0, 2], key), ([1], key)]
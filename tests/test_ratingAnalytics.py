@@ -0,0 +1,31 @@
+import numpy as np
+
+from ratingAnalytics import RatingTable
+
+
+def constant_and_varying(n=6):
+    scripts = [f"s{i}" for i in range(n)] * 2
+    values = [0.1] * n + [float(i) for i in range(n)]
+    return RatingTable.from_records(["A"] * n + ["B"] * n, scripts, ["x"] * 2 * n, values)
+
+
+def test_constant_group_has_no_spread():
+    stats = {row['task']: row for row in constant_and_varying().group_stats("task")}
+    assert stats["A"]['std'] == 0.0
+    assert np.isclose(stats["B"]['std'], np.std(np.arange(6)))
+
+
+def test_constant_task_has_no_correlation():
+    corr, tasks = constant_and_varying().correlation()
+    assert list(tasks) == ["A", "B"]
+    assert np.isnan(corr[0]).all() and np.isnan(corr[:, 0]).all()
+    assert np.isclose(corr[1, 1], 1.0)
+
+
+def test_correlation_survives_a_large_offset():
+    n = 50
+    x = np.linspace(-1, 1, n)
+    values = list(1e6 + x) + list(1e6 - 2 * x)
+    table = RatingTable.from_records(["A"] * n + ["B"] * n, [f"s{i}" for i in range(n)] * 2, ["x"] * 2 * n, values)
+    corr, _ = table.correlation()
+    assert np.allclose(corr, [[1.0, -1.0], [-1.0, 1.0]])
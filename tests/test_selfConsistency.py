@@ -0,0 +1,18 @@
+from mockBackend import MockBackend
+from selfConsistency import vote
+
+
+def test_unseeded_rounds_draw_fresh_samples(response_cache):
+    # alternating answers never settle, so every round is drawn
+    backend = MockBackend(answer=["Yes", "No"]).install()
+    result = vote(["Is it?"], parse=str.strip, samples_per_round=2, max_samples=8, seed=None)[0]
+    assert result['samples'] == 8
+    assert backend.prompts == 8
+    assert result['distribution'] == {"Yes": 0.5, "No": 0.5}
+
+
+def test_seeded_vote_is_cached(response_cache):
+    backend = MockBackend(answer=["Yes", "No"]).install()
+    first = vote(["Is it?"], parse=str.strip, samples_per_round=2, max_samples=8, seed=3)
+    assert vote(["Is it?"], parse=str.strip, samples_per_round=2, max_samples=8, seed=3) == first
+    assert backend.prompts == 8